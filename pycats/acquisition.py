@@ -0,0 +1,279 @@
+import heapq
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Thread, Condition
+
+
+__all__ = ['AcquisitionScheduler', 'StatusAcquisition']
+
+
+class StatusAcquisition:
+    """
+    Acquisition of the status of a CS8Connection and publication of the
+    results for a consumer (e.g. the Tango device).
+
+    Each poll publishes, atomically, the latest StatusSnapshot together with
+    the changes accumulated since the consumer last took them, so no change
+    is lost when the consumer is slower than the acquisition.
+
+    The acquisition period adapts to the activity of the robot: it is kept
+    at its minimum while a path is running or the robot is inside one of
+    the diffractometer areas (RI1/RI2), and grows by the backoff factor on
+    every idle poll up to the maximum period.
+
+    :param cs8connection: Connected CS8Connection.
+    :param period: Acquisition period in seconds (minimum period when the
+      acquisition is adaptive).
+    :param max_period: Maximum period in seconds while the robot is idle.
+      Defaults to period, i.e. a fixed acquisition rate.
+    :param backoff: Factor applied to the period on every idle poll.
+    :param cond: Condition notified on every publication. Acquisitions
+      sharing it can be waited for together, see AcquisitionScheduler.
+    """
+
+    def __init__(self, cs8connection, period, max_period=None, backoff=1.5,
+                 cond=None):
+        self.cs8connection = cs8connection
+        self.min_period = period
+        self.max_period = max(max_period or period, period)
+        self.backoff = backoff
+        self.period = period
+
+        self._cond = Condition() if cond is None else cond
+        self._seq = 0
+        self._consumed_seq = 0
+        self._snapshot = None
+        self._changes = {}
+        self._error = None
+
+    def poll(self):
+        """
+        Read the status once and publish it.
+
+        :return: None
+        """
+        try:
+            _, changes = self.cs8connection.get_status_delta()
+        except Exception as e:
+            self.publish_error(e)
+            return
+
+        self.publish(self.cs8connection.get_last_status(), changes)
+
+    def publish(self, snapshot, changes):
+        """
+        Publish a status read by the caller (e.g. a FleetPoller).
+
+        :param snapshot: StatusSnapshot of the read.
+        :param changes: Changes since the previous read, as returned by
+          CS8Connection.get_status_delta().
+        :return: None
+        """
+        self.adapt_period(snapshot)
+        with self._cond:
+            pending = self._changes
+            for key, (old_value, new_value) in changes.items():
+                if key in pending:
+                    old_value = pending[key][0]
+                    if old_value == new_value:
+                        del pending[key]
+                        continue
+                pending[key] = (old_value, new_value)
+            self._snapshot = snapshot
+            self._error = None
+            self._seq += 1
+            self._cond.notify_all()
+
+    def publish_error(self, error):
+        """
+        Publish a failed status read.
+
+        :param error: Exception raised by the read.
+        :return: None
+        """
+        self.period = self.min_period
+        with self._cond:
+            self._error = error
+            self._seq += 1
+            self._cond.notify_all()
+
+    def adapt_period(self, snapshot):
+        """
+        Update the acquisition period from the activity of the robot.
+
+        :param snapshot: Latest StatusSnapshot.
+        :return: The new period in seconds.
+        """
+        if snapshot.get('PATH_RUNNING_1_0') or snapshot.get('PRO7_RI1') \
+                or snapshot.get('PRO8_RI2'):
+            self.period = self.min_period
+        else:
+            self.period = min(self.period * self.backoff, self.max_period)
+        return self.period
+
+    def has_news(self):
+        """
+        :return: True if something was published since the last consume().
+        """
+        with self._cond:
+            return self._seq != self._consumed_seq
+
+    def latest(self):
+        """
+        :return: The latest published StatusSnapshot, or None.
+        """
+        with self._cond:
+            return self._snapshot
+
+    def wait_newer(self, snapshot, timeout=None):
+        """
+        Wait until a snapshot other than the given one is published. Unlike
+        consume(), any number of threads can wait at the same time.
+
+        :param snapshot: StatusSnapshot already seen, or None.
+        :param timeout: Maximum time to wait in seconds (None waits forever).
+        :return: The latest published StatusSnapshot (the given one if
+          nothing new was published before the timeout).
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._snapshot is not snapshot,
+                                timeout)
+            return self._snapshot
+
+    def consume(self, timeout=None):
+        """
+        Take what was published since the last call, waiting for a new
+        publication if there is none yet.
+
+        :param timeout: Maximum time to wait in seconds (None waits forever).
+        :return: None if nothing new was published before the timeout,
+          otherwise a tuple (snapshot, changes, error). error is the
+          exception raised by the latest poll, if it failed; the changes
+          published before it are returned as well and must be applied.
+        """
+        with self._cond:
+            if self._seq == self._consumed_seq:
+                # the condition may be shared with other acquisitions
+                self._cond.wait_for(
+                    lambda: self._seq != self._consumed_seq, timeout)
+                if self._seq == self._consumed_seq:
+                    return None
+            self._consumed_seq = self._seq
+            changes, self._changes = self._changes, {}
+            return self._snapshot, changes, self._error
+
+
+class AcquisitionScheduler:
+    """
+    Poll several StatusAcquisitions on a shared pool of worker threads,
+    each of them at its own (possibly adaptive) period.
+
+    The polls are scheduled on absolute deadlines, so the period does not
+    drift with the time spent reading the status, and the deadlines missed
+    by a poll overrunning the period are skipped instead of queued. An
+    acquisition never has more than one poll in flight, so a slow
+    CATS server only delays its own acquisition. All the acquisitions
+    created by the scheduler share one publication condition, which lets a
+    single consumer wait for any of them (see wait()).
+
+    :param max_workers: Number of worker threads, see ThreadPoolExecutor.
+    """
+
+    def __init__(self, max_workers=None):
+        self.published = Condition()
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._lock = Condition()
+        self._heap = []
+        self._counter = itertools.count()
+        self._acquisitions = set()
+        self._in_flight = {}
+        self._stopped = False
+
+        self._thread = Thread(target=self._dispatch,
+                              name='AcquisitionScheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, cs8connection, period, max_period=None):
+        """
+        Start polling the status of a CS8Connection.
+
+        :param cs8connection: CS8Connection. It is only polled while
+          connected.
+        :param period: Acquisition period in seconds, see StatusAcquisition.
+        :param max_period: Maximum acquisition period in seconds.
+        :return: The StatusAcquisition publishing its status.
+        """
+        acquisition = StatusAcquisition(cs8connection, period, max_period,
+                                        cond=self.published)
+        with self._lock:
+            self._acquisitions.add(acquisition)
+            self._push(acquisition, time.monotonic())
+        return acquisition
+
+    def remove(self, acquisition):
+        """
+        Stop polling an acquisition, waiting for its poll in flight.
+
+        :param acquisition: StatusAcquisition returned by add().
+        :return: None
+        """
+        with self._lock:
+            self._acquisitions.discard(acquisition)
+            future = self._in_flight.get(acquisition)
+        if future is not None:
+            wait([future])
+
+    def wait(self, timeout=None):
+        """
+        Wait until any of the acquisitions has something new to consume.
+
+        :param timeout: Maximum time to wait in seconds (None waits forever).
+        :return: True if there is something to consume.
+        """
+        with self._lock:
+            acquisitions = list(self._acquisitions)
+        with self.published:
+            return self.published.wait_for(
+                lambda: any(acq.has_news() for acq in acquisitions), timeout)
+
+    def shutdown(self):
+        with self._lock:
+            self._stopped = True
+            self._lock.notify()
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _push(self, acquisition, deadline):
+        heapq.heappush(self._heap,
+                       (deadline, next(self._counter), acquisition))
+        self._lock.notify()
+
+    def _dispatch(self):
+        with self._lock:
+            while not self._stopped:
+                now = time.monotonic()
+                while self._heap and self._heap[0][0] <= now:
+                    deadline, _, acquisition = heapq.heappop(self._heap)
+                    if acquisition in self._acquisitions:
+                        self._in_flight[acquisition] = self._executor.submit(
+                            self._poll, acquisition, deadline)
+                timeout = self._heap[0][0] - now if self._heap else None
+                self._lock.wait(timeout)
+
+    def _poll(self, acquisition, deadline):
+        try:
+            if acquisition.cs8connection.connected:
+                acquisition.poll()
+        finally:
+            period = acquisition.period
+            deadline += period
+            now = time.monotonic()
+            if deadline < now:
+                missed = int((now - deadline) / period) + 1
+                deadline += missed * period
+            with self._lock:
+                self._in_flight.pop(acquisition, None)
+                if acquisition in self._acquisitions and not self._stopped:
+                    self._push(acquisition, deadline)
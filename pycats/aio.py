@@ -0,0 +1,194 @@
+import asyncio
+from collections import deque
+
+from .core import CS8Commands, MODEL_CATS, MODEL_ISARA, MODELS
+from .framing import TERMINATOR
+from .logger import get_logger
+
+
+__all__ = ['AsyncCS8Connection']
+
+
+class _AsyncChannel:
+    """
+    One of the two sockets of the IRELEC server (operate or monitor) on
+    asyncio streams.
+
+    A reader task takes the answers in order and resolves the future of the
+    oldest pending request, so several requests (from one pipelined burst or
+    from concurrent callers) can be in flight at the same time. A cancelled
+    request keeps its place in the queue: its late answer is dropped instead
+    of being given to the next request.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = deque()
+        self.error = None
+        self._task = asyncio.ensure_future(self._read_answers())
+
+    def request(self, cmds):
+        """
+        Write one or several requests in a single write.
+
+        :param cmds: List of commands, without terminator.
+        :return: List of futures, one per command, resolved with the raw
+          answer (bytes without terminator).
+        """
+        if self.error is not None:
+            raise self.error
+        loop = asyncio.get_event_loop()
+        futures = [loop.create_future() for _ in cmds]
+        self.writer.write(
+            TERMINATOR.join(cmd.encode() for cmd in cmds) + TERMINATOR)
+        self.pending.extend(futures)
+        return futures
+
+    async def _read_answers(self):
+        try:
+            while True:
+                frame = await self.reader.readuntil(TERMINATOR)
+                if not self.pending:
+                    continue
+                future = self.pending.popleft()
+                if not future.done():
+                    future.set_result(frame[:-1])
+        except asyncio.CancelledError:
+            self.error = ConnectionError("Connection to CATS server closed")
+        except asyncio.IncompleteReadError:
+            self.error = ConnectionError("Connection closed by CATS server")
+        except Exception as e:
+            self.error = e
+
+        while self.pending:
+            future = self.pending.popleft()
+            if not future.done():
+                future.set_exception(self.error)
+
+    async def close(self):
+        self._task.cancel()
+        self.writer.close()
+
+
+class AsyncCS8Connection(CS8Commands):
+    """
+    asyncio client of the IRELEC server.
+
+    It has the same commands as CS8Connection (put, getput, state, di, ...)
+    but each of them returns an awaitable, e.g.::
+
+        cs8 = AsyncCS8Connection()
+        await cs8.connect('bl13cats.cells.es', 1000, 10000)
+        state = await cs8.state()
+        await cs8.getput(2, 1, 3, 0, 0, 0, 0, 0)
+
+    No thread or lock is involved: requests on the same socket are written
+    as they come and matched in order with the answers. A command can be
+    cancelled (e.g. with asyncio.wait_for) without desynchronising the
+    socket.
+    """
+
+    def __init__(self):
+        self._init_logging()
+        self.chan_op = None
+        self.chan_mon = None
+        self.host = None
+        self.operate_port = None
+        self.monitor_port = None
+        self.connected = False
+        self.model = MODEL_CATS  # default.  set_model() to change it
+        self._last_command_sent = ""
+
+    def _init_logging(self):
+        logger = get_logger(__name__)
+        self.debug = logger.debug
+        self.info = logger.info
+        self.warn = logger.warning
+        self.error = logger.error
+
+    def set_model(self, model):
+        if model in ["Isara", "isara", "i"]:
+            self.model = MODEL_ISARA
+
+    def get_model(self):
+        if self.model in MODELS:
+            return MODELS[self.model]
+        return "Unknown"
+
+    def get_last_command_sent(self):
+        return self._last_command_sent
+
+    async def connect(self, host, operate_port, monitor_port):
+        self.host = host
+        self.operate_port = operate_port
+        self.monitor_port = monitor_port
+
+        reader, writer = await asyncio.open_connection(host, operate_port)
+        self.chan_op = _AsyncChannel(reader, writer)
+        reader, writer = await asyncio.open_connection(host, monitor_port)
+        self.chan_mon = _AsyncChannel(reader, writer)
+
+        self.connected = True
+        self.info("Connected to CATS server")
+
+    async def disconnect(self):
+        self.connected = False
+        for channel in (self.chan_op, self.chan_mon):
+            if channel is not None:
+                await channel.close()
+        self.chan_op = None
+        self.chan_mon = None
+
+    async def _query(self, channel, cmds):
+        """
+        Send the commands in a single write and wait for their answers.
+
+        :param channel:
+        :param cmds: List of commands.
+        :return: List with the answers, in the same order as cmds.
+        """
+        if not self.connected or channel.error is not None:
+            self.connected = False
+            raise ConnectionError("Not connected to CATS server")
+
+        futures = channel.request(cmds)
+        answers = []
+        try:
+            await channel.writer.drain()
+            for cmd, future in zip(cmds, futures):
+                received = str(await future, 'utf-8')
+                cmd_name = (cmd.find('(') > 0 and cmd[:cmd.find('(')]) or cmd
+                if not received.startswith(cmd_name) and cmd != 'message':
+                    msg = 'Answer is not the one expected:\nCmd: %s\nAns: %s' % (
+                        cmd, received)
+                    self.error(msg)
+                answers.append(received)
+        except BaseException:
+            # the answers still to come are dropped by the channel
+            for future in futures:
+                future.cancel()
+            if channel.error is not None:
+                self.connected = False
+            raise
+        return answers
+
+    # OPERATE HELPER FUNCTIONS
+    async def operate(self, cmd):
+        received = (await self._query(self.chan_op, [cmd]))[0]
+        self.debug("%s --> %s" % (cmd, received))
+        self._last_command_sent = cmd
+        return received
+
+    # MONITOR HELPER FUNCTIONS
+    async def monitor(self, cmd):
+        return (await self._query(self.chan_mon, [cmd]))[0]
+
+    async def monitor_pipelined(self, cmds):
+        """
+        Send several monitor requests in one burst and collect their replies.
+
+        :param cmds: List of monitor commands, e.g. ['state', 'di'].
+        :return: List with the answers, in the same order as cmds.
+        """
+        return await self._query(self.chan_mon, cmds)
@@ -0,0 +1,185 @@
+import operator
+import shlex
+from threading import Event
+
+
+__all__ = ['StatusCondition', 'StatusWaiter']
+
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+def _parse_value(token):
+    lower = token.lower()
+    if lower == 'true':
+        return True
+    if lower == 'false':
+        return False
+    for convert in (int, float):
+        try:
+            return convert(token)
+        except ValueError:
+            pass
+    return token
+
+
+class _Term:
+    """
+    Comparison of the value of one status key with a constant.
+    """
+
+    def __init__(self, key, op, value):
+        self.key = key
+        self.op = op
+        self.value = value
+        self.compare = OPERATORS[op]
+
+    def __repr__(self):
+        return '%s %s %r' % (self.key, self.op, self.value)
+
+    def evaluate(self, value):
+        if value is None:
+            return False
+        if isinstance(self.value, str):
+            value = str(value).strip()
+        try:
+            return self.compare(value, self.value)
+        except TypeError:
+            return False
+
+
+class StatusCondition:
+    """
+    Predicate over the status keys, e.g.
+    "PATH_RUNNING_1_0 false and PRO5_IDL true".
+
+    A condition is made of terms "KEY [OPERATOR] VALUE" joined with 'and'
+    and 'or' ('and' binds tighter). OPERATOR is one of ==, !=, <, <=, >, >=
+    and defaults to ==. VALUE is true, false, a number or a string (quoted
+    if it contains spaces), strings being compared to the stripped value.
+
+    The condition is evaluated incrementally: reset() evaluates every term
+    on a snapshot, and update() re-evaluates only the terms of the keys
+    that changed.
+
+    :param text: The condition.
+    :raises ValueError: Syntax error in the condition.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self._terms = []
+        self._groups = [[]]  # 'or' of 'and' groups of term indexes
+        self._truth = []
+        self._by_key = {}
+        self.satisfied = False
+        self._parse(text)
+        self.keys = frozenset(self._by_key)
+
+    def __repr__(self):
+        return 'StatusCondition(%r)' % self.text
+
+    def _parse(self, text):
+        tokens = shlex.split(text)
+        if not tokens:
+            raise ValueError("Empty condition")
+        i = 0
+        while True:
+            if len(tokens) - i < 2:
+                raise ValueError("Incomplete condition: %s" % text)
+            key = tokens[i]
+            if tokens[i + 1] in OPERATORS:
+                if len(tokens) - i < 3:
+                    raise ValueError("Incomplete condition: %s" % text)
+                op, value = tokens[i + 1], tokens[i + 2]
+                i += 3
+            else:
+                op, value = '==', tokens[i + 1]
+                i += 2
+            self._add_term(_Term(key, op, _parse_value(value)))
+
+            if i == len(tokens):
+                break
+            joint = tokens[i].lower()
+            if joint == 'or':
+                self._groups.append([])
+            elif joint != 'and':
+                raise ValueError(
+                    "Expected 'and' or 'or' instead of %r in: %s" %
+                    (tokens[i], text))
+            i += 1
+
+    def _add_term(self, term):
+        index = len(self._terms)
+        self._terms.append(term)
+        self._truth.append(False)
+        self._groups[-1].append(index)
+        self._by_key.setdefault(term.key, []).append(index)
+
+    def _combine(self):
+        self.satisfied = any(all(self._truth[i] for i in group)
+                             for group in self._groups)
+        return self.satisfied
+
+    def reset(self, snapshot):
+        """
+        Evaluate every term on a status.
+
+        :param snapshot: StatusSnapshot or status dict.
+        :return: True if the condition is satisfied.
+        """
+        for i, term in enumerate(self._terms):
+            self._truth[i] = term.evaluate(snapshot.get(term.key))
+        return self._combine()
+
+    def update(self, changes):
+        """
+        Re-evaluate the terms of the changed keys.
+
+        :param changes: Dict key -> (old_value, new_value), as returned by
+          StatusSnapshot.diff().
+        :return: True if the condition is satisfied.
+        """
+        if self.keys.isdisjoint(changes):
+            return self.satisfied
+        for key in self.keys.intersection(changes):
+            new_value = changes[key][1]
+            for i in self._by_key[key]:
+                self._truth[i] = self._terms[i].evaluate(new_value)
+        return self._combine()
+
+
+class StatusWaiter:
+    """
+    A thread waiting for a StatusCondition, see
+    CS8Connection.wait_until().
+
+    :ivar snapshot: The StatusSnapshot that satisfied the condition.
+    """
+
+    def __init__(self, condition):
+        self.condition = condition
+        self.snapshot = None
+        self._event = Event()
+
+    def notify(self, snapshot):
+        self.snapshot = snapshot
+        self._event.set()
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        :return: The StatusSnapshot that satisfied the condition, or None if
+          the timeout expired.
+        """
+        self._event.wait(timeout)
+        return self.snapshot
@@ -1,13 +1,22 @@
 import time
 import socket
 import struct
-from threading import Lock
+from threading import Condition, Lock
 
+from .framing import CANCEL_CHECK_PERIOD, ReplyChannel, RequestCancelled
+from .conditions import StatusCondition, StatusWaiter
+from .history import StatusHistory
 from .logger import get_logger
+from .observers import StatusDispatcher
+from .recorder import MonitorRecorder
+from .stats import LatencyStats
+from .standby import MonitorStandby
+from .status import StatusLayout, StatusSnapshot
+from .watchdog import LifeBitWatchdog, enable_keepalive
 
 
-__all__ = ['CS8Connection', 'di_params', 'do_params', 'state_params',
-           'position_params']
+__all__ = ['CS8Connection', 'RequestCancelled', 'StatusSnapshot',
+           'di_params', 'do_params', 'state_params', 'position_params']
 
 
 MODEL_CATS, MODEL_ISARA = (0, 1)
@@ -21,6 +30,31 @@ PUCK_IGNORE, PUCK_SPINE, PUCK_UNIPUCK = (0, 1, 2)
 RECOVER_GET_FAILED = 1
 SOCKET_RECV_TIMEOUT = 3
 
+# Time in seconds allowed for the answer of some commands, the others get
+# SOCKET_RECV_TIMEOUT. The status requests fail fast so that a slow answer
+# does not stall the status acquisition.
+COMMAND_DEADLINES = {
+    'abort': 1,
+    'panic': 1,
+    'pause': 1,
+    'backup': 30,
+    'restore': 30,
+    'state': 1,
+    'di': 1,
+    'di2': 1,
+    'do': 1,
+    'position': 1,
+    'message': 1,
+    'config': 1,
+}
+
+# Emergency commands, sent through the priority lane of the operate socket
+PRIORITY_COMMANDS = ('abort', 'panic', 'pause')
+
+# Monitor registers that can be part of the status
+STATUS_REGISTERS = ('state', 'di', 'di2', 'do', 'position', 'message',
+                    'config')
+
 state_params = [
     'POWER_1_0',
     'AUTO_MODE_STATUS_1_0',
@@ -365,280 +399,182 @@ position_params = [
     'RZ_POSITION_IN_MM']
 
 
-TOOL_FLANGE = 0
-TOOL_CRYOTONG = 1
-TOOL_EMBL_ESRF = 2
-TOOL_PLATES = 3
-TOOL_PUCK = 4
-
-
-class CS8Connection:
-    def __init__(self, host=None, operate_port=None, monitor_port=None):
-        self._init_logging()
-        self.sock_op = None
-        self.lock_op = Lock()
-        self.sock_mon = None
-        self.lock_mon = Lock()
-
-        self.host = None
-        self.operate_port = None
-        self.monitor_port = None
-        self.connected = False
-        self._t0 = time.time()
-
-        self.model = MODEL_CATS  # default.  set_model() to change it
+def _payload(answer):
+    """
+    Zero-copy view of the arguments of a monitor answer, i.e. whatever is
+    between the opening parenthesis and the closing one at the end.
 
-        # info for checking path safe condition for diffractometer
-        self.pathinfo = {'safe': False, 'running': False}
+    :param answer: Raw answer (bytes), e.g. b'di(0110...)'
+    :return: memoryview on answer
+    """
+    return memoryview(answer)[answer.find(b'(') + 1:-1]
 
-        self.is_running = False
-        self.is_safe = False
-        self.ri1_count = 0
-        self.ri2_count = 0
-        self.is_inr1 = False
-        self.is_inr2 = False
-        self.executing_recovery = False
 
-        # grp1 contains paths with one single passage through diffr areas
-        self.check_paths_grp1 = ['get', 'put', 'put_bcrd', 'get_HT', 'put_HT']
+def _payload_str(answer):
+    return str(_payload(answer), 'utf-8')
 
-        # grp2 contains paths with two passages through diffr areas
-        # note: for unipuck double gripper still it is only one pass for all
-        self.check_paths_grp2 = ['getput', 'getput_bcrd', 'getput_HT']
 
-        # get contains paths including a get operation (to detect recovery
-        # needed)
-        self.check_paths_get = [
-            'getput',
-            'getput_bcrd',
-            'getput_HT',
-            'get',
-            'get_HT']
+def _parse_mask(view):
+    """
+    Convert a field of '0'/'1' characters into an integer bitmask where bit
+    i holds the i-th character of the field.
+    """
+    return int(view[::-1].tobytes() or b'0', 2)
 
-        self.check_paths_all = self.check_paths_grp1 + self.check_paths_grp2
 
-        # use set_puck_types() or property puck_types in device server to
-        # change
-        self.nb_pucks = 9  # Default 9 pucks
-        self.puck_types = [PUCK_SPINE, ] * self.nb_pucks  # default SPINE pucks
-        self.puck_presence = [False, ] * self.nb_pucks
+def _bit_positions(params):
+    """
+    Precompute the bit position of each named signal of a register
+    (spare bits, named '.', are skipped).
+    """
+    return dict((i, key) for i, key in enumerate(params) if key != '.')
 
-        if host is not None and operate_port is not None and monitor_port is not None:
-            self.connect(host, operate_port, monitor_port)
 
-        # variables for recovery routines
-        self.sample_before_path = -1
-        self.lid_before_path = -1
-        self.puck_before_path = -1
-        self.latest_path = ""
+di_bits = _bit_positions(di_params)
+di_bits_isara = _bit_positions(di_params_isara)
+do_bits = _bit_positions(do_params)
 
-        self._last_command_sent = ""
+# ISARA reports the puck number instead of the lid number
+state_aliases_isara = {
+    'LID_NUM_SAMPLE_MOUNTED_ON_TOOL': 'PUCK_NUM_SAMPLE_MOUNTED_ON_TOOL',
+    'LID_NUM_SAMPLE_MOUNTED_ON_DIFFRACTOMETER':
+        'PUCK_NUM_SAMPLE_MOUNTED_ON_DIFFRACTOMETER',
+}
 
-        self.info("Init CATS connection object")
 
-    def __del__(self):
-        self.disconnect()
+# state_params columns holding a number (-1 when empty)
+state_numbers = [
+    'LID_NUM_SAMPLE_MOUNTED_ON_TOOL',
+    'NUM_SAMPLE_ON_TOOL',
+    'LID_NUM_SAMPLE_MOUNTED_ON_DIFFRACTOMETER',
+    'NUM_SAMPLE_MOUNTED_ON_DIFFRACTOMETER',
+    'NUM_OF_PLATE_ON_TOOL',
+    'WELL_NUM',
+    'PUCK_DET_RESULT_DEW1',
+    'PUCK_DET_RESULT_DEW2',
+    'POSITION_NUM_DEW1',
+    'POSITION_NUM_DEW2',
+    'LID_NUM_SAMPLE_MOUNTED_ON_TOOL2',
+    'NUM_SAMPLE_ON_TOOL2',
+    'CURR_NUM_SOAKING',
+    'PUCK_TYPE_LID1',
+    'PUCK_TYPE_LID2',
+    'PUCK_TYPE_LID3']
 
-    def _init_logging(self):
-        logger = get_logger(__name__)
-        self.debug = logger.debug
-        self.info = logger.info
-        self.warn = logger.warning
-        self.error = logger.error
-        self.debug("Creating new logger %s" % __name__)
 
-    def set_model(self, model):
-        if model in ["Isara", "isara", "i"]:
-            self.model = MODEL_ISARA
+def _to_flag(v):
+    # Make flags boolean :-D
+    return v == '1'
 
-    def get_model(self):
-        if self.model in MODELS:
-            return MODELS[self.model]
-        return "Unknown"
 
-    def set_puck_types(self, puck_types):
-        self.nb_pucks = len(puck_types)
-        self.puck_types = [None, ] * self.nb_pucks
+def _to_number(v):
+    # Make numbers integer :-D
+    if v == '':
+        return -1
+    return int(v)
 
-        for i in range(self.nb_pucks):
-            puck_typ = puck_types[i]
-            if puck_typ == '2':
-                self.puck_types[i] = PUCK_UNIPUCK
-            elif puck_typ == '1':
-                self.puck_types[i] = PUCK_SPINE
-            elif puck_typ == '0':
-                self.puck_types[i] = PUCK_IGNORE
-            else:
-                print("Unknown puck type %s. Puck is ignored " % puck_typ)
-                self.puck_types[i] = PUCK_IGNORE
 
-    def get_number_pucks(self):
-        return self.nb_pucks
+def _to_ratio(v):
+    # round to avoid massive change push event on update
+    return round(float(v), 3)
 
-    def get_puck_types(self):
-        p_types = self.puck_types
-        return p_types
 
-    def get_puck_presence(self):
-        return self.puck_presence
+def _to_str(v):
+    return v
 
-    def is_path_safe(self):
-        return self.is_safe
 
-    def connect(self, host, operate_port, monitor_port):
-        self.host = host
-        self.operate_port = operate_port
-        self.monitor_port = monitor_port
+def _state_parse_plan(model):
+    """
+    Build the parse plan of the state answer for a model.
 
-        # Operate the CATS system
-        self.sock_op = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock_op.setsockopt(
-            socket.SOL_SOCKET,
-            socket.SO_LINGER,
-            struct.pack(
-                'ii',
-                1,
-                0))
-        self.sock_op.connect((self.host, self.operate_port))
-        # Monitor the CATS system
-        self.sock_mon = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.sock_mon.setsockopt(
-            socket.SOL_SOCKET,
-            socket.SO_LINGER,
-            struct.pack(
-                'ii',
-                1,
-                0))
-        self.sock_mon.connect((self.host, self.monitor_port))
+    :return: List with, for each column of the state answer, a tuple
+      (converter, keys) where keys are the status keys of the column (two
+      of them for the ISARA PUCK_NUM aliases).
+    """
+    plan = []
+    for key in state_params:
+        if key.endswith('_1_0'):
+            converter = _to_flag
+        elif key in state_numbers:
+            converter = _to_number
+        elif key == 'ROBOT_SPEED_RATIO':
+            converter = _to_ratio
+        else:
+            converter = _to_str
 
-        # Add timeout for recv command for both sockets
-        self.sock_mon.settimeout(SOCKET_RECV_TIMEOUT)
-        self.sock_op.settimeout(SOCKET_RECV_TIMEOUT)
+        if model is MODEL_ISARA and key in state_aliases_isara:
+            keys = (state_aliases_isara[key], key)
+        else:
+            keys = (key,)
+        plan.append((converter, keys))
+    return plan
 
-        # Flag connected
-        self.connected = True
-        self.info("Connected to CATS server")
-        self.debug("Operation socket created (host=%s , port=%s" % (
-            self.host, self.operate_port))
-        self.debug("Monitor socket created (host=%s , port=%s" % (
-            self.host, self.monitor_port))
 
-    def disconnect(self):
-        if self.sock_op is not None:
-            self.sock_op.close()
-            self.sock_op = None
-        if self.sock_mon is not None:
-            self.sock_mon.close()
-            self.sock_mon = None
-        # if you disconnect and connect immediately, some times you receive
-        # '[Errno 104] Connection reset by peer'
-        time.sleep(0.05)
-        # self.info("Disconnected from CATS server")
+TOOL_FLANGE = 0
+TOOL_CRYOTONG = 1
+TOOL_EMBL_ESRF = 2
+TOOL_PLATES = 3
+TOOL_PUCK = 4
 
-    def reconnect(self, every=5, timeout=30):
-        """
-        Routine to be added to a control loop for managing the reconnection.
-        Tries to reconnect to the CATS server until a timeout is reached.
 
-        :param every: Wait for this amount before next reconnection attempt.
-        :param timeout: Reconnection timeout.
-        :return: None
-        """
-        self.debug("Trying to reconnect...")
-        et = time.time() - self._t0
-        if et > timeout:
-            raise RuntimeError("Reconnection timeout, aborting...")
+class PriorityLock:
+    """
+    Lock whose priority acquirers go before the normal ones already
+    waiting. Used as a context manager it is acquired without priority.
+    """
 
-        self.disconnect()
-        try:
-            self.connect(self.host, self.operate_port, self.monitor_port)
-            self.connected = True
-            self._t0 = time.time()
-        except Exception as e:
-            self.error("Error trying to reconnect: %s" % str(e))
-            self.debug("Next reconnection attempt in {} seconds.".format(every))
-            time.sleep(every)
+    def __init__(self):
+        self._cond = Condition(Lock())
+        self._locked = False
+        self._priority_waiting = 0
 
-    def _query(self, sock, cmd):
+    def acquire(self, priority=False, timeout=None):
         """
-        The general method to query commands to the IRELEC server.
-        The sock parameter could be any of the 2 sockets: monitor or operation.
-        Both sockets have been configured with a timeout for the recv method.
-
-        :param sock:
-        :param cmd:
-        :return:
+        :param priority: Go before the normal acquirers waiting.
+        :param timeout: Maximum time to wait in seconds (None waits forever).
+        :return: True if the lock was acquired.
         """
-        _cmd = cmd + '\r'
-
-        if self.connected:
-
-            try:
-                sock.send(_cmd.encode())
-            except Exception as e:
-                template = "Exception [{}] when sending command {} : {}"
-                self.error(template.format(type(e).__name__, _cmd, e))
-                self.connected = False
-                self._t0 = time.time()
-                raise
-
+        with self._cond:
+            if priority:
+                self._priority_waiting += 1
             try:
-                received = sock.recv(1024)
-            except Exception as e:
-                template = "Exception [{}] when accessing buffer: {}"
-                self.error(template.format(type(e).__name__, e))
-                self.connected = False
-                self._t0 = time.time()
-                raise
-
-            # !!! WARNING !!!
-            # THERE IS NO CONTROL OF THE END OF MESSAGE
-            #
-            # AS IT IS SAID IN http://www.amk.ca/python/howto/sockets/
-            # SECTION "3 Using a Socket"
-            #
-            # A protocol like HTTP uses a socket for only one
-            # transfer. The client sends a request, the reads a
-            # reply. That's it. The socket is discarded. This
-            # means that a client can detect the end of the reply
-            # by receiving 0 bytes.
-            #
-            # But if you plan to reuse your socket for further
-            # transfers, you need to realize that there is no
-            # "EOT" (End of Transfer) on a socket. I repeat: if a
-            # socket send or recv returns after handling 0 bytes,
-            # the connection has been broken. If the connection
-            # has not been broken, you may wait on a recv forever,
-            # because the socket will not tell you that there's
-            # nothing more to read (for now). Now if you think
-            # about that a bit, you'll come to realize a
-            # fundamental truth of sockets: messages must either
-            # be fixed length (yuck), or be delimited (shrug), or
-            # indicate how long they are (much better), or end by
-            # shutting down the connection. The choice is entirely
-            # yours, (but some ways are righter than others).
-
-            # CHECK THAT THE ANSWER IS FROM THE COMMAND SENT
-            received = received.decode('utf-8')
-            received = received.replace('\r', '')
-            cmd_name = (cmd.find('(') > 0 and cmd[:cmd.find('(')]) or cmd
-            if not received.startswith(cmd_name) and cmd != 'message':
-                msg = 'Answer is not the one expected:\nCmd: %s\nAns: %s' % (
-                    cmd, received)
-                self.error(msg)
-            #    raise Exception(msg)
-            else:
-                pass
-            return received
-
-    # OPERATE HELPER FUNCTIONS
-    def operate(self, cmd):
-        with self.lock_op:
-            #      return self._query(self.sock_op, cmd)
-            received = self._query(self.sock_op, cmd)
-            self.debug("%s --> %s" % (cmd, received))
-            self._last_command_sent = cmd
-            return received
+                acquired = self._cond.wait_for(
+                    lambda: not self._locked and (
+                        priority or not self._priority_waiting), timeout)
+                if acquired:
+                    self._locked = True
+                return acquired
+            finally:
+                if priority:
+                    self._priority_waiting -= 1
+                    if not self._priority_waiting:
+                        self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self._locked = False
+            self._cond.notify_all()
+
+    def locked(self):
+        return self._locked
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class CS8Commands:
+    """
+    Command set of the IRELEC server (section 3.6.5 of its documentation).
+
+    Every command is built here and sent through self.operate() or
+    self.monitor(), which the connection classes implement. With
+    CS8Connection they return the answer, with AsyncCS8Connection an
+    awaitable.
+    """
 
     # 3.6.5.1 General commands
     def powerOn(self): return self.operate('on')
@@ -1388,12 +1324,6 @@ class CS8Connection:
 
     def resetmotion(self): return self.operate('resetMotion')
 
-    # MONITOR HELPER FUNCTIONS
-
-    def monitor(self, cmd):
-        with self.lock_mon:
-            return self._query(self.sock_mon, cmd)
-
     # 3.6.5.7 Status commands
     def state(self): return self.monitor('state')
 
@@ -1409,128 +1339,891 @@ class CS8Connection:
 
     def config(self): return self.monitor('config')
 
-    # Some timing tests:
-    # %timeit -n 10 -r 10 cs8connection.state()
-    # 10 loops, best of 10: 14.8 ms per loop
-    # %timeit -n 10 -r 10 cs8connection.di()
-    # 10 loops, best of 10: 22.7 ms per loop
-    # %timeit -n 10 -r 10 cs8connection.do()
-    # 10 loops, best of 10: 17.3 ms per loop
-    #  %timeit -n 10 -r 10 cs8connection.position()
-    # 10 loops, best of 10: 12.9 ms per loop
-    # %timeit -n 10 -r 10 cs8connection.message()
-    # 10 loops, best of 10: 11.2 ms per loop
-    #
-    # 14.8+22.7+17.3+12.9+11.2 = 78.9 ms
-    # %timeit -n 10 -r 10 c.getStatusDict()
-    # 10 loops, best of 10: 84 ms per loop
 
-    def get_status_dict(self):
-        try:
-            state_ans = self.state()
-            di_ans = self.di()
-            do_ans = self.do()
+class CS8Connection(CS8Commands):
+    def __init__(self, host=None, operate_port=None, monitor_port=None):
+        self._init_logging()
+        self.sock_op = None
+        self.chan_op = None
+        self.lock_op = PriorityLock()
+        self.sock_mon = None
+        self.chan_mon = None
+        self.lock_mon = Lock()
 
-            if self.model is MODEL_ISARA:
-                di2_ans = self.di2()
+        self.host = None
+        self.operate_port = None
+        self.monitor_port = None
+        self.connected = False
+        self._t0 = time.time()
 
-            position_ans = self.position()
-            message_ans = self.message()
-        except Exception as e:
-            self.error("Exception when reading status from server: %s" % str(e))
+        # time source of the status timestamps (replaced by a replay)
+        self.clock = time.time
 
-            raise e
+        self.model = MODEL_CATS  # default.  set_model() to change it
 
-        status_dict = {}
-
-        # State
-        state_values = state_ans[state_ans.find('(') + 1:-1].split(',')
-        for i, v in enumerate(state_values):
-            key = state_params[i]
-            # Make flags boolean :-D
-            if key.endswith('_1_0'):
-                v = v == '1'
-            # Make numbers integer :-D
-            elif key in ['LID_NUM_SAMPLE_MOUNTED_ON_TOOL',
-                         'NUM_SAMPLE_ON_TOOL',
-                         'LID_NUM_SAMPLE_MOUNTED_ON_DIFFRACTOMETER',
-                         'NUM_SAMPLE_MOUNTED_ON_DIFFRACTOMETER',
-                         'NUM_OF_PLATE_ON_TOOL',
-                         'WELL_NUM',
-                         'PUCK_DET_RESULT_DEW1',
-                         'PUCK_DET_RESULT_DEW2',
-                         'POSITION_NUM_DEW1',
-                         'POSITION_NUM_DEW2',
-                         'LID_NUM_SAMPLE_MOUNTED_ON_TOOL2',
-                         'NUM_SAMPLE_ON_TOOL2',
-                         'CURR_NUM_SOAKING',
-                         'PUCK_TYPE_LID1',
-                         'PUCK_TYPE_LID2',
-                         'PUCK_TYPE_LID3']:
-                if v == '':
-                    v = -1
-                else:
-                    v = int(v)
-            elif key == 'ROBOT_SPEED_RATIO':
-                # round to avoid massive change push event on update
-                v = round(float(v), 3)
+        # send all the status requests in one burst. set_pipelined() to change
+        self.pipelined = True
 
-            if self.model is MODEL_ISARA and\
-                    key == 'LID_NUM_SAMPLE_MOUNTED_ON_TOOL':
-                status_dict['PUCK_NUM_SAMPLE_MOUNTED_ON_TOOL'] = v
-            elif self.model is MODEL_ISARA and \
-                    key == 'LID_NUM_SAMPLE_MOUNTED_ON_DIFFRACTOMETER':
-                status_dict['PUCK_NUM_SAMPLE_MOUNTED_ON_DIFFRACTOMETER'] = v
+        # latest raw answer and parsed values of each status register
+        self._parsed_answers = {}
+        self._register_read_time = {}
 
-            status_dict[key] = v
+        # polling period of each status register. set_register_periods()
+        self.register_periods = {}
 
-        # DI
-        di_str = di_ans[di_ans.find('(') + 1:-1]
-        di_values = [x == '1' for x in di_str]
+        # spare monitor socket. set_standby_monitor() to enable it
+        self.standby = None
 
-        if self.model is MODEL_ISARA:
-            pars = di_params_isara
-        else:
-            pars = di_params
-
-        for i, v in enumerate(di_values):
-            key = pars[i]
-            if key != '.':
-                status_dict[key] = v
-
-        # DO
-        do_str = do_ans[do_ans.find('(') + 1:-1]
-        do_values = [x == '1' for x in do_str]
-        for i, v in enumerate(do_values):
-            key = do_params[i]
-            if key != '.':
-                status_dict[key] = v
-
-        # POSITION
-        position_values = position_ans[position_ans.find(
-            '(') + 1:-1].split(',')
-        for i, v in enumerate(position_values):
-            key = position_params[i]
-            # round to avoid massive change push event on update
-            status_dict[key] = round(float(v), 3)
-
-        # MESSAGE
-        status_dict['MESSAGE'] = message_ans
+        # time allowed for the answer of each command.
+        # set_command_deadlines() to change it
+        self.command_deadlines = dict(COMMAND_DEADLINES)
 
-        # DETERMINE CASETTE PRESENCE INFO
-        if self.model is MODEL_ISARA:
-            try:
-                di2_ans = di2_ans[4:-1]  # remove di2( and final ) from answer
-                if len(di2_ans) != len(self.puck_types):
-                    self.puck_presence = [False, ] * len(self.nb_pucks)
-                else:
-                    self.puck_presence = list(
-                        map(bool, [int(ch) for ch in di2_ans]))
-            except Exception:
-                self.puck_presence = [False, ] * len(self.nb_pucks)
-        else:
-            self.puck_presence = [False, ] * self.nb_pucks
-            for i in range(self.nb_pucks):
+        # latency of the commands of the priority lane, from the call to
+        # their answer
+        self.priority_stats = LatencyStats()
+
+        # dead link detection. set_keepalive(), set_life_bit_watchdog()
+        self.keepalive = None
+        self.life_bit_watchdog = None
+        self._snapshot = None
+
+        # threads blocked in wait_until()
+        self._waiters = []
+        self._waiters_lock = Lock()
+
+        # calls the status callbacks. Created by the first subscribe()
+        self.dispatcher = None
+
+        # recent status snapshots. set_history() to enable it
+        self.history = None
+
+        # raw replies of the monitor socket. set_recorder() to enable it
+        self.recorder = None
+        self._build_parse_plans()
+        self._status_parsers = {
+            'state': self._parse_state,
+            'di': self._parse_di,
+            'di2': self._parse_di2,
+            'do': self._parse_do,
+            'position': self._parse_position,
+            'message': self._parse_message,
+            'config': self._parse_config,
+        }
+
+        # info for checking path safe condition for diffractometer
+        self.pathinfo = {'safe': False, 'running': False}
+
+        self.is_running = False
+        self.is_safe = False
+        self.ri1_count = 0
+        self.ri2_count = 0
+        self.is_inr1 = False
+        self.is_inr2 = False
+        self.executing_recovery = False
+
+        # grp1 contains paths with one single passage through diffr areas
+        self.check_paths_grp1 = ['get', 'put', 'put_bcrd', 'get_HT', 'put_HT']
+
+        # grp2 contains paths with two passages through diffr areas
+        # note: for unipuck double gripper still it is only one pass for all
+        self.check_paths_grp2 = ['getput', 'getput_bcrd', 'getput_HT']
+
+        # get contains paths including a get operation (to detect recovery
+        # needed)
+        self.check_paths_get = [
+            'getput',
+            'getput_bcrd',
+            'getput_HT',
+            'get',
+            'get_HT']
+
+        self.check_paths_all = self.check_paths_grp1 + self.check_paths_grp2
+
+        # use set_puck_types() or property puck_types in device server to
+        # change
+        self.nb_pucks = 9  # Default 9 pucks
+        self.puck_types = [PUCK_SPINE, ] * self.nb_pucks  # default SPINE pucks
+        self.puck_presence = [False, ] * self.nb_pucks
+
+        if host is not None and operate_port is not None and monitor_port is not None:
+            self.connect(host, operate_port, monitor_port)
+
+        # variables for recovery routines
+        self.sample_before_path = -1
+        self.lid_before_path = -1
+        self.puck_before_path = -1
+        self.latest_path = ""
+
+        self._last_command_sent = ""
+
+        self.info("Init CATS connection object")
+
+    def __del__(self):
+        self.disconnect()
+
+    def _init_logging(self):
+        logger = get_logger(__name__)
+        self.debug = logger.debug
+        self.info = logger.info
+        self.warn = logger.warning
+        self.error = logger.error
+        self.debug("Creating new logger %s" % __name__)
+
+    def set_model(self, model):
+        if model in ["Isara", "isara", "i"]:
+            self.model = MODEL_ISARA
+        self._parsed_answers.clear()
+        self._build_parse_plans()
+        if self.dispatcher is not None:
+            self.dispatcher.layout = self._status_layout
+            self.dispatcher.reset()
+
+    def _build_parse_plans(self):
+        """
+        Prepare, for the current model, the converter of each column of the
+        state answer and the layout of the status snapshots.
+        """
+        state_plan = _state_parse_plan(self.model)
+        self._state_converters = [converter for converter, _ in state_plan]
+        if self.model is MODEL_ISARA:
+            di_table = di_bits_isara
+        else:
+            di_table = di_bits
+        self._status_layout = StatusLayout(
+            [keys for _, keys in state_plan], di_table, do_bits,
+            position_params)
+
+    def get_model(self):
+        if self.model in MODELS:
+            return MODELS[self.model]
+        return "Unknown"
+
+    def set_puck_types(self, puck_types):
+        self._parsed_answers.clear()
+        self.nb_pucks = len(puck_types)
+        self.puck_types = [None, ] * self.nb_pucks
+
+        for i in range(self.nb_pucks):
+            puck_typ = puck_types[i]
+            if puck_typ == '2':
+                self.puck_types[i] = PUCK_UNIPUCK
+            elif puck_typ == '1':
+                self.puck_types[i] = PUCK_SPINE
+            elif puck_typ == '0':
+                self.puck_types[i] = PUCK_IGNORE
+            else:
+                print("Unknown puck type %s. Puck is ignored " % puck_typ)
+                self.puck_types[i] = PUCK_IGNORE
+
+    def set_register_periods(self, periods):
+        """
+        Poll some status registers at their own rate. Registers without a
+        period are read in every status read; 'config' is only read when it
+        has a period.
+
+        :param periods: Dict register name -> period in seconds, e.g.
+          {'position': 0.05, 'do': 0.1, 'state': 0.2, 'message': 1}
+        :return: None
+        """
+        for register in periods:
+            if register not in STATUS_REGISTERS:
+                raise ValueError("Unknown status register %s" % register)
+        self.register_periods = dict(periods)
+
+    def get_shortest_register_period(self):
+        """
+        :return: Shortest register period in seconds, or None. The registers
+          are only checked when the status is read, so the status must be
+          read at least that often for the periods to be honoured.
+        """
+        periods = [period for period in self.register_periods.values()
+                   if period]
+        return min(periods) if periods else None
+
+    def get_number_pucks(self):
+        return self.nb_pucks
+
+    def get_puck_types(self):
+        p_types = self.puck_types
+        return p_types
+
+    def get_puck_presence(self):
+        return self.puck_presence
+
+    def is_path_safe(self):
+        return self.is_safe
+
+    def connect(self, host, operate_port, monitor_port):
+        self.host = host
+        self.operate_port = operate_port
+        self.monitor_port = monitor_port
+
+        # Operate the CATS system
+        self.sock_op = self._open_socket(self.operate_port)
+        # Monitor the CATS system
+        self.sock_mon = self._open_socket(self.monitor_port)
+
+        # Framing of the answers on both sockets
+        self.chan_op = ReplyChannel(self.sock_op)
+        self.chan_mon = ReplyChannel(self.sock_mon)
+
+        # Flag connected
+        self.connected = True
+        self.info("Connected to CATS server")
+        self.debug("Operation socket created (host=%s , port=%s" % (
+            self.host, self.operate_port))
+        self.debug("Monitor socket created (host=%s , port=%s" % (
+            self.host, self.monitor_port))
+
+    def _open_socket(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(
+            socket.SOL_SOCKET,
+            socket.SO_LINGER,
+            struct.pack(
+                'ii',
+                1,
+                0))
+        sock.connect((self.host, port))
+        # Add timeout for recv command
+        sock.settimeout(SOCKET_RECV_TIMEOUT)
+        if self.keepalive is not None:
+            enable_keepalive(sock, *self.keepalive)
+        return sock
+
+    def disconnect(self):
+        if self.sock_op is not None:
+            self.sock_op.close()
+            self.sock_op = None
+            self.chan_op = None
+        if self.sock_mon is not None:
+            self.sock_mon.close()
+            self.sock_mon = None
+            self.chan_mon = None
+        # next status read after a reconnection reports all the values
+        self._parsed_answers.clear()
+        self._snapshot = None
+        if self.life_bit_watchdog is not None:
+            self.life_bit_watchdog.reset()
+        # if you disconnect and connect immediately, some times you receive
+        # '[Errno 104] Connection reset by peer'
+        time.sleep(0.05)
+        # self.info("Disconnected from CATS server")
+
+    def reconnect(self, every=5, timeout=30):
+        """
+        Routine to be added to a control loop for managing the reconnection.
+        Tries to reconnect to the CATS server until a timeout is reached.
+        It blocks for every seconds after a failed attempt, see
+        pycats.reconnection.Reconnection for a background alternative.
+
+        :param every: Wait for this amount before next reconnection attempt.
+        :param timeout: Reconnection timeout.
+        :return: None
+        """
+        self.debug("Trying to reconnect...")
+        et = time.time() - self._t0
+        if et > timeout:
+            raise RuntimeError("Reconnection timeout, aborting...")
+
+        self.disconnect()
+        try:
+            self.connect(self.host, self.operate_port, self.monitor_port)
+            self.connected = True
+            self._t0 = time.time()
+        except Exception as e:
+            self.error("Error trying to reconnect: %s" % str(e))
+            self.debug("Next reconnection attempt in {} seconds.".format(every))
+            time.sleep(every)
+
+    def set_keepalive(self, idle, interval=1, count=3):
+        """
+        Enable TCP keepalive on the sockets to the CATS server (the current
+        ones and the ones opened later), see watchdog.enable_keepalive().
+
+        :param idle: Idle time in seconds before the first probe. 0 or None
+          disables the keepalive.
+        :param interval: Time in seconds between probes.
+        :param count: Number of unanswered probes before the link is dead.
+        :return: None
+        """
+        if idle:
+            self.keepalive = (idle, interval, count)
+        else:
+            self.keepalive = None
+        for sock in (self.sock_op, self.sock_mon):
+            if sock is None:
+                continue
+            if self.keepalive is not None:
+                enable_keepalive(sock, *self.keepalive)
+            else:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 0)
+
+    def set_life_bit_watchdog(self, max_cycles):
+        """
+        Watch the PLC life bits, see watchdog.LifeBitWatchdog.
+
+        :param max_cycles: Number of reads of the di register without
+          toggle before the PLC is stale. 0 or None disables the watchdog.
+        :return: None
+        """
+        if max_cycles:
+            self.life_bit_watchdog = LifeBitWatchdog(max_cycles)
+        else:
+            self.life_bit_watchdog = None
+
+    def set_history(self, capacity):
+        """
+        Keep the latest status snapshots in a StatusHistory.
+
+        :param capacity: Number of snapshots kept. 0 or None disables the
+          history.
+        :return: None
+        """
+        if capacity:
+            self.history = StatusHistory(capacity)
+        else:
+            self.history = None
+
+    def set_recorder(self, directory, **kwargs):
+        """
+        Record the raw replies of the monitor socket in rotating files, see
+        recorder.MonitorRecorder.
+
+        :param directory: Directory of the files. None stops the recording.
+        :param kwargs: Other arguments of MonitorRecorder (max_bytes,
+          max_age, max_files...).
+        :return: None
+        """
+        if self.recorder is not None:
+            self.recorder.stop()
+            self.recorder = None
+        if directory:
+            self.recorder = MonitorRecorder(directory, **kwargs)
+            self.recorder.start()
+
+    def _record(self, cmds, answers):
+        if self.recorder is not None and answers and answers[0] is not None:
+            self.recorder.record(time.time(), cmds, answers)
+
+    def set_standby_monitor(self, check_period):
+        """
+        Keep a spare monitor socket connected, health-checked every
+        check_period seconds, and switch to it when the monitor socket
+        fails instead of losing the connection.
+
+        :param check_period: Period of the health check in seconds. 0 or
+          None removes the spare socket.
+        :return: None
+        """
+        if self.standby is not None:
+            self.standby.stop()
+            self.standby = None
+        if check_period:
+            self.standby = MonitorStandby(self, check_period)
+            self.standby.start()
+
+    def _failover_monitor(self):
+        """
+        Replace the failed monitor socket with the standby one. Must be
+        called with lock_mon held.
+
+        :return: True if the standby socket was swapped in.
+        """
+        if self.standby is None:
+            return False
+        spare = self.standby.take()
+        if spare is None:
+            return False
+        self.warn("Monitor socket failed, switching to the standby socket")
+        if self.sock_mon is not None:
+            self.sock_mon.close()
+        self.sock_mon, self.chan_mon = spare
+        return True
+
+    def _connection_lost(self):
+        # the reconnect() timeout counts from this moment
+        self.connected = False
+        self._t0 = time.time()
+
+    def _query(self, channel, cmds, raw=False, deadline=None,
+               keep_link=False):
+        """
+        The general method to query commands to the IRELEC server.
+        The channel parameter could be any of the 2 channels: monitor or
+        operation.
+
+        All the commands are written in a single send. The answers are read
+        through the channel's frame reader, which splits the stream on the
+        carriage return terminator, and are matched in order with the
+        commands sent.
+
+        Each answer must arrive within the deadline of its command (see
+        set_command_deadlines()). When a deadline passes, the requests still
+        pending are abandoned: their late answers are discarded and the
+        connection is kept, unless the answers of earlier abandoned requests
+        did not arrive either.
+
+        :param channel:
+        :param cmds: List of commands.
+        :param raw: Return the answers as bytes instead of decoding them.
+        :param deadline: Time in seconds for the answers, instead of the
+          deadlines of the commands.
+        :param keep_link: Never treat a passed deadline as a lost link.
+        :raises socket.timeout: A deadline passed.
+        :raises RequestCancelled: cancel() was called.
+        :return: List with the answers, in the same order as cmds.
+        """
+        if not self.connected:
+            return [None, ] * len(cmds)
+
+        try:
+            return self._exchange(channel, cmds, raw, deadline)
+        except RequestCancelled:
+            channel.abandon()
+            raise
+        except Exception as e:
+            slow = isinstance(e, socket.timeout) and (
+                keep_link or not channel.abandoned)
+            channel.abandon()
+            if channel is not self.chan_mon or not self._failover_monitor():
+                if not slow:
+                    self._connection_lost()
+                raise
+
+        # monitor requests only read the status: send them again on the
+        # standby socket
+        try:
+            return self._exchange(self.chan_mon, cmds, raw, deadline)
+        except Exception:
+            self._connection_lost()
+            raise
+
+    def _exchange(self, channel, cmds, raw, deadline):
+        start = time.monotonic()
+        if deadline is None:
+            deadlines = [start + self.get_command_deadline(cmd)
+                         for cmd in cmds]
+        else:
+            deadlines = [start + deadline] * len(cmds)
+
+        try:
+            channel.send(cmds)
+        except Exception as e:
+            template = "Exception [{}] when sending command {} : {}"
+            self.error(template.format(type(e).__name__, cmds, e))
+            raise
+
+        answers = []
+        for cmd_deadline in deadlines:
+            try:
+                cmd, frame = channel.receive(cmd_deadline)
+            except Exception as e:
+                template = "Exception [{}] when accessing buffer: {}"
+                self.error(template.format(type(e).__name__, e))
+                raise
+
+            # CHECK THAT THE ANSWER IS FROM THE COMMAND SENT
+            if raw:
+                received = bytes(frame)
+            else:
+                received = str(frame, 'utf-8')
+            cmd_name = (cmd.find('(') > 0 and cmd[:cmd.find('(')]) or cmd
+            if raw:
+                cmd_name = cmd_name.encode()
+            if not received.startswith(cmd_name) and cmd != 'message':
+                msg = 'Answer is not the one expected:\nCmd: %s\nAns: %s' % (
+                    cmd, received)
+                self.error(msg)
+            #    raise Exception(msg)
+            answers.append(received)
+        return answers
+
+    def get_command_deadline(self, cmd):
+        """
+        :param cmd: Command, with or without arguments.
+        :return: Time in seconds allowed for the answer of the command.
+        """
+        cmd_name = (cmd.find('(') > 0 and cmd[:cmd.find('(')]) or cmd
+        return self.command_deadlines.get(cmd_name, SOCKET_RECV_TIMEOUT)
+
+    def set_command_deadlines(self, deadlines):
+        """
+        Change the time allowed for the answers of some commands.
+
+        :param deadlines: Dict command name -> time in seconds, e.g.
+          {'backup': 60, 'state': 0.5}
+        :return: None
+        """
+        self.command_deadlines.update(deadlines)
+
+    def cancel(self, operate=True, monitor=True):
+        """
+        Cancel the requests waiting for an answer, from another thread. The
+        call waiting for them raises RequestCancelled and their answers are
+        discarded when they arrive.
+
+        :param operate: Cancel the request on the operate socket.
+        :param monitor: Cancel the requests on the monitor socket.
+        :return: None
+        """
+        for cancel, channel in ((operate, self.chan_op),
+                                (monitor, self.chan_mon)):
+            if cancel and channel is not None:
+                channel.cancel()
+
+    # OPERATE HELPER FUNCTIONS
+    def operate(self, cmd, deadline=None):
+        """
+        :param cmd: Command. The PRIORITY_COMMANDS go through
+          operate_priority().
+        :param deadline: Time in seconds for the answer. Defaults to the
+          deadline of the command, see set_command_deadlines().
+        :return: The answer.
+        """
+        if cmd in PRIORITY_COMMANDS:
+            return self.operate_priority(cmd, deadline)
+        with self.lock_op:
+            #      return self._query(self.chan_op, [cmd])[0]
+            received = self._query(self.chan_op, [cmd],
+                                   deadline=deadline)[0]
+            self.debug("%s --> %s" % (cmd, received))
+            self._last_command_sent = cmd
+            return received
+
+    def operate_priority(self, cmd, deadline=None):
+        """
+        Send an emergency command (abort, panic, pause) ahead of the normal
+        commands. It goes before the commands waiting for the operate
+        socket, and the command waiting for its answer, if any, is
+        cancelled (its caller gets RequestCancelled and the answer is
+        discarded when it arrives), so a stop never waits behind a slow
+        answer. The answers of the cancelled commands still come first on
+        the socket, so the deadline of the emergency command is extended by
+        the deadlines of those commands, and missing it does not drop the
+        connection. The latency from the call to the answer is accounted in
+        priority_stats.
+
+        :param cmd: Command.
+        :param deadline: Time in seconds for the answer. Defaults to the
+          deadline of the command, see set_command_deadlines().
+        :return: The answer.
+        """
+        start = time.monotonic()
+        while not self.lock_op.acquire(priority=True,
+                                       timeout=CANCEL_CHECK_PERIOD):
+            if self.chan_op is not None:
+                self.chan_op.cancel()
+        try:
+            if deadline is None:
+                deadline = self.get_command_deadline(cmd)
+            channel = self.chan_op
+            if channel is not None and channel.abandoned:
+                # wait for the answers still due before ours
+                abandoned = list(channel.pending)[:channel.abandoned]
+                deadline += sum(self.get_command_deadline(pending)
+                                for pending in abandoned)
+            received = self._query(channel, [cmd], deadline=deadline,
+                                   keep_link=True)[0]
+        except Exception:
+            self.priority_stats.add_error()
+            raise
+        finally:
+            self.lock_op.release()
+        latency = time.monotonic() - start
+        self.priority_stats.add(latency)
+        self.info("%s --> %s (%.1f ms)" % (cmd, received, 1000 * latency))
+        self._last_command_sent = cmd
+        return received
+
+    # MONITOR HELPER FUNCTIONS
+
+    def monitor(self, cmd, deadline=None):
+        with self.lock_mon:
+            answers = self._query(self.chan_mon, [cmd], deadline=deadline)
+        self._record([cmd], answers)
+        return answers[0]
+
+    def monitor_pipelined(self, cmds, deadline=None):
+        """
+        Send several monitor requests in one burst and collect their replies.
+
+        :param cmds: List of monitor commands, e.g. ['state', 'di'].
+        :param deadline: Time in seconds for the answers. Defaults to the
+          deadline of each command.
+        :return: List with the answers, in the same order as cmds.
+        """
+        with self.lock_mon:
+            answers = self._query(self.chan_mon, cmds, deadline=deadline)
+        self._record(cmds, answers)
+        return answers
+
+    def _monitor_raw(self, cmds):
+        """
+        Read the answers of several monitor commands as bytes, pipelined or
+        one by one depending on the pipelined mode.
+        """
+        with self.lock_mon:
+            if self.pipelined:
+                answers = self._query(self.chan_mon, cmds, raw=True)
+            else:
+                answers = [self._query(self.chan_mon, [cmd], raw=True)[0]
+                           for cmd in cmds]
+        self._record(cmds, answers)
+        return answers
+
+    # Some timing tests:
+    # %timeit -n 10 -r 10 cs8connection.state()
+    # 10 loops, best of 10: 14.8 ms per loop
+    # %timeit -n 10 -r 10 cs8connection.di()
+    # 10 loops, best of 10: 22.7 ms per loop
+    # %timeit -n 10 -r 10 cs8connection.do()
+    # 10 loops, best of 10: 17.3 ms per loop
+    #  %timeit -n 10 -r 10 cs8connection.position()
+    # 10 loops, best of 10: 12.9 ms per loop
+    # %timeit -n 10 -r 10 cs8connection.message()
+    # 10 loops, best of 10: 11.2 ms per loop
+    #
+    # 14.8+22.7+17.3+12.9+11.2 = 78.9 ms
+    # %timeit -n 10 -r 10 c.getStatusDict()
+    # 10 loops, best of 10: 84 ms per loop
+
+    #
+    # With the pipelined mode all the requests above are written at once and
+    # the whole status costs roughly one round trip.
+
+    def set_pipelined(self, pipelined):
+        self.pipelined = bool(pipelined)
+
+    def get_status_dict(self):
+        """
+        Read the status.
+
+        :return: Dict with the value of every status key. See
+          get_last_status() and get_status_delta() to avoid the copy.
+        """
+        return dict(self._update_status()[1])
+
+    def get_status_delta(self):
+        """
+        Read the status and return only the values that changed since the
+        previous read. The first read reports every key as changed.
+
+        :return: Tuple (timestamp, changes). timestamp is the time when the
+          answers were received and changes maps each changed key to a
+          tuple (old_value, new_value), old_value being None for new keys.
+        """
+        timestamp, _, changes = self._update_status()
+        return timestamp, changes
+
+    def get_last_status(self):
+        """
+        :return: The StatusSnapshot of the latest status read, or None.
+        """
+        return self._snapshot
+
+    def get_status_layout(self):
+        """
+        :return: The StatusLayout of the snapshots for the current model.
+        """
+        return self._status_layout
+
+    def is_plc_stale(self):
+        """
+        :return: True if the life bit watchdog detected a frozen PLC.
+        """
+        return self.life_bit_watchdog is not None and \
+            self.life_bit_watchdog.stale
+
+    def wait_until(self, condition, timeout=None):
+        """
+        Block until the status read by the acquisition loop satisfies a
+        condition, e.g. "PATH_RUNNING_1_0 false and PRO5_IDL true" (see
+        conditions.StatusCondition). The condition is checked on the latest
+        status, then only when one of its keys changes. The status must be
+        read meanwhile by another thread, e.g. a StatusAcquisition.
+
+        :param condition: Condition string or StatusCondition.
+        :param timeout: Maximum wait in seconds (None for no limit).
+        :raises ValueError: Syntax error or unknown key in the condition.
+        :return: The StatusSnapshot satisfying the condition, or None if the
+          timeout expired.
+        """
+        waiter = self.add_waiter(condition)
+        try:
+            return waiter.wait(timeout)
+        finally:
+            self.remove_waiter(waiter)
+
+    def add_waiter(self, condition):
+        """
+        Watch a condition without blocking, see wait_until().
+
+        :param condition: Condition string or StatusCondition.
+        :raises ValueError: Syntax error or unknown key in the condition.
+        :return: A StatusWaiter, set once the condition is satisfied. It must
+          be passed to remove_waiter() when no longer needed.
+        """
+        if not isinstance(condition, StatusCondition):
+            condition = StatusCondition(condition)
+        unknown = sorted(condition.keys.difference(self._status_layout.index))
+        if unknown:
+            raise ValueError("Unknown status key(s): %s" % ", ".join(unknown))
+
+        waiter = StatusWaiter(condition)
+        with self._waiters_lock:
+            snapshot = self._snapshot
+            if snapshot is not None and condition.reset(snapshot):
+                waiter.notify(snapshot)
+            else:
+                self._waiters.append(waiter)
+        return waiter
+
+    def remove_waiter(self, waiter):
+        with self._waiters_lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _notify_waiters(self, snapshot, changes):
+        # called with _waiters_lock held
+        for waiter in self._waiters:
+            if waiter.condition.update(changes):
+                waiter.notify(snapshot)
+        self._waiters = [waiter for waiter in self._waiters
+                         if not waiter.is_set()]
+
+    def subscribe(self, callback, keys=None, group=None):
+        """
+        Call callback(snapshot, changes) when some status keys change, see
+        observers.StatusDispatcher. The callbacks run in a thread of their
+        own, fed by the thread reading the status.
+
+        :param callback: Callable(snapshot, changes), changes being the dict
+          key -> (old_value, new_value) of the observed keys that changed.
+        :param keys: Status keys to observe.
+        :param group: Key group to observe: 'state', 'di', 'do',
+          'position', 'message' or 'config'. Any change is observed when
+          neither keys nor group is given.
+        :return: The Subscription, to be passed to unsubscribe().
+        """
+        if self.dispatcher is None:
+            self.dispatcher = StatusDispatcher(self._status_layout)
+            self.dispatcher.publish(self._snapshot)
+            self.dispatcher.start()
+        return self.dispatcher.subscribe(callback, keys, group)
+
+    def unsubscribe(self, subscription):
+        if self.dispatcher is not None:
+            self.dispatcher.unsubscribe(subscription)
+
+    def close(self):
+        """
+        Disconnect and stop the threads of the connection: the status
+        dispatcher (dropping the subscriptions), the standby monitor socket
+        and the recorder.
+        """
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+            self.dispatcher = None
+        self.set_standby_monitor(None)
+        self.set_recorder(None)
+        self.disconnect()
+
+    def _is_register_due(self, cmd, now):
+        if cmd not in self._parsed_answers:
+            return True
+        period = self.register_periods.get(cmd)
+        if not period:
+            return True
+        # small tolerance so that the jitter of the polling loop does not
+        # delay a register by one cycle
+        return now - self._register_read_time[cmd] >= 0.9 * period
+
+    def _status_requests(self):
+        """
+        :return: Tuple (cmds, due) with the status registers of the model
+          and those of them that must be read in this cycle.
+        """
+        cmds = ['state', 'di', 'do']
+        if self.model is MODEL_ISARA:
+            cmds.append('di2')
+        cmds += ['position', 'message']
+        if self.register_periods.get('config'):
+            cmds.append('config')
+
+        # Read only the registers due, the others keep their latest answer
+        now = self.clock()
+        due = [cmd for cmd in cmds if self._is_register_due(cmd, now)]
+        return cmds, due
+
+    def _update_status(self):
+        cmds, due = self._status_requests()
+
+        try:
+            answers = self._monitor_raw(due) if due else []
+        except Exception as e:
+            self.error("Exception when reading status from server: %s" % str(e))
+
+            raise e
+
+        return self._process_status(cmds, due, answers)
+
+    def _process_status(self, cmds, due, answers):
+        """
+        Build the status snapshot from the raw answers of a status read and
+        update the path and recovery information.
+
+        :param cmds: Status registers of the model, see _status_requests().
+        :param due: Registers read in this cycle.
+        :param answers: Raw answers of the registers in due.
+        :return: Tuple (timestamp, snapshot, changes).
+        """
+        timestamp = self.clock()
+
+        # Parse only the registers whose answer changed since the last cycle.
+        # The fields of unchanged registers are shared with the previous
+        # snapshot, so the diff only looks into the changed ones.
+        for cmd, raw in zip(due, answers):
+            self._register_read_time[cmd] = timestamp
+            cached = self._parsed_answers.get(cmd)
+            if cached is None or cached[0] != raw:
+                self._parsed_answers[cmd] = (
+                    raw, self._status_parsers[cmd](raw))
+        fields = dict((cmd, self._parsed_answers[cmd][1]) for cmd in cmds)
+
+        di_mask, di_len = fields['di']
+        do_mask, do_len = fields['do']
+        status_dict = StatusSnapshot(
+            timestamp, self._status_layout, fields['state'],
+            di_mask, di_len, do_mask, do_len, fields['position'],
+            fields['message'], fields.get('config'))
+        previous = self._snapshot
+        changes = status_dict.diff(previous)
+        # under the lock of add_waiter(), so that a waiter either sees this
+        # snapshot or gets its changes
+        with self._waiters_lock:
+            self._snapshot = status_dict
+            if self._waiters:
+                self._notify_waiters(status_dict, changes)
+        if self.dispatcher is not None:
+            # after a reconnection, notify what changed while disconnected
+            self.dispatcher.publish(
+                status_dict, changes if previous is not None else None)
+        if self.history is not None and changes:
+            self.history.append(status_dict)
+
+        if self.life_bit_watchdog is not None and 'di' in due:
+            if self.life_bit_watchdog.update(status_dict):
+                if self.life_bit_watchdog.stale:
+                    self.warn("PLC life bits not toggling: %s" % ", ".join(
+                        self.life_bit_watchdog.stale_keys()))
+                else:
+                    self.info("PLC life bits toggling again")
+
+        # DETERMINE CASETTE PRESENCE INFO
+        if self.model is not MODEL_ISARA:
+            self.puck_presence = [False, ] * self.nb_pucks
+            for i in range(self.nb_pucks):
                 st_key = "CASSETTE_%d_PRESENCE" % (i + 1)
                 self.puck_presence[i] = status_dict[st_key]
 
@@ -1583,9 +2276,48 @@ class CS8Connection:
 #                       " idle=%(idle)s / home=%(home)s / ri1=%(in_area1)s /"
 #                       " ri2 = %(in_area2)s / safe = %(safe)s'" % self.pathinfo)
 
+        return timestamp, status_dict, changes
+
+    # Each parser converts the raw answer of its register into the field
+    # stored in the StatusSnapshot.
+
+    def _parse_state(self, state_ans):
+        state_values = _payload_str(state_ans).split(',')
+        return tuple([convert(v) for convert, v in
+                      zip(self._state_converters, state_values)])
+
+    def _parse_di(self, di_ans):
+        view = _payload(di_ans)
+        return _parse_mask(view), len(view)
+
+    def _parse_di2(self, di2_ans):
+        # di2 only carries the cassette presence (ISARA)
+        di2_bits = _payload(di2_ans)  # remove di2( and final )
+        try:
+            mask = _parse_mask(di2_bits)
+        except Exception:
+            mask = 0
+        if len(di2_bits) != len(self.puck_types):
+            self.puck_presence = [False, ] * self.nb_pucks
+        else:
+            self.puck_presence = [bool(mask >> i & 1)
+                                  for i in range(self.nb_pucks)]
+        return mask, len(di2_bits)
+
+    def _parse_do(self, do_ans):
+        view = _payload(do_ans)
+        return _parse_mask(view), len(view)
+
+    def _parse_position(self, position_ans):
+        position_values = _payload_str(position_ans).split(',')
+        # round to avoid massive change push event on update
+        return tuple(round(float(v), 3) for v in position_values)
 
+    def _parse_message(self, message_ans):
+        return str(message_ans, 'utf-8')
 
-        return status_dict
+    def _parse_config(self, config_ans):
+        return str(config_ans, 'utf-8')
 
     def check_recovery_needed(self):
         if self.ri1_count == 1 and self.pathinfo['pathname'] in self.check_paths_get:
@@ -0,0 +1,187 @@
+import time
+from concurrent.futures import Future
+from queue import Queue
+from threading import Thread, Event
+
+from .logger import get_logger
+
+
+__all__ = ['PathCommand', 'TrajectoryExecutor']
+
+
+class PathCommand:
+    """
+    A trajectory command queued in a TrajectoryExecutor.
+
+    :ivar acknowledged: Future resolved with the answer of the CS8 to the
+      command.
+    :ivar completed: Future resolved with the first StatusSnapshot where the
+      path is no longer running.
+    :ivar path: Name of the path, known once the command is sent.
+    """
+
+    def __init__(self, name, args, kwargs):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.path = None
+        self.acknowledged = Future()
+        self.completed = Future()
+
+    def __repr__(self):
+        return 'PathCommand(%s%r)' % (self.name, self.args)
+
+    def cancel(self):
+        """
+        Cancel the command if it was not sent yet.
+
+        :return: True if the command was cancelled.
+        """
+        if self.acknowledged.cancel():
+            self.completed.cancel()
+            return True
+        return False
+
+
+class TrajectoryExecutor(Thread):
+    """
+    Queue of trajectory commands, sent one after the other: each command is
+    sent once the path of the previous one has completed.
+
+    The end of a path is followed in the status published by a
+    StatusAcquisition: the path starts when PATH_RUNNING_1_0 is set with
+    PATH_NAME equal to the path, and completes when either changes. ::
+
+        executor = TrajectoryExecutor(cs8, acquisition)
+        executor.start()
+        put = executor.submit('put', 2, 1, 3, 0, 0, 0, 0, 0)
+        get = executor.submit('get', 2, 0, 0, 0, 0)
+        put.acknowledged.result()
+        snapshot = get.completed.result(timeout=300)
+
+    :param cs8connection: CS8Connection sending the commands.
+    :param acquisition: StatusAcquisition polling the status of the
+      cs8connection.
+    :param start_timeout: Seconds after the acknowledgement after which a
+      path never seen running is considered completed.
+    :param path_timeout: Maximum duration in seconds of a path (None for no
+      limit).
+    """
+
+    def __init__(self, cs8connection, acquisition, start_timeout=5.,
+                 path_timeout=None):
+        Thread.__init__(self, name='TrajectoryExecutor')
+        self.daemon = True
+        logger = get_logger(__name__)
+        self.debug = logger.debug
+        self.error = logger.error
+
+        self.cs8connection = cs8connection
+        self.acquisition = acquisition
+        self.start_timeout = start_timeout
+        self.path_timeout = path_timeout
+        self._queue = Queue()
+        self._stop_event = Event()
+
+    def submit(self, name, *args, **kwargs):
+        """
+        Queue a trajectory command.
+
+        :param name: Name of the CS8Connection method sending the command
+          (e.g. 'put', 'getput', 'home').
+        :param args: Arguments of the method.
+        :return: A PathCommand.
+        """
+        if not callable(getattr(self.cs8connection, name, None)):
+            raise ValueError("Unknown command %s" % name)
+        command = PathCommand(name, args, kwargs)
+        self._queue.put(command)
+        return command
+
+    def stop_running(self):
+        """
+        Stop the executor. The commands not sent yet are cancelled.
+        """
+        self._stop_event.set()
+        self._queue.put(None)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            command = self._queue.get()
+            if command is None:
+                break
+            self.execute(command)
+
+        while not self._queue.empty():
+            command = self._queue.get()
+            if command is not None:
+                command.cancel()
+
+    def execute(self, command):
+        if not command.acknowledged.set_running_or_notify_cancel():
+            command.completed.cancel()
+            return
+        command.completed.set_running_or_notify_cancel()
+
+        try:
+            answer = getattr(self.cs8connection, command.name)(
+                *command.args, **command.kwargs)
+        except Exception as e:
+            self.error("Error sending %r: %s" % (command, str(e)))
+            command.acknowledged.set_exception(e)
+            command.completed.set_exception(e)
+            return
+        ack_time = time.time()
+        sent = self.cs8connection.get_last_command_sent()
+        command.path = (sent.find('(') > 0 and sent[:sent.find('(')]) or sent
+        command.acknowledged.set_result(answer)
+
+        try:
+            snapshot = self.wait_path(command.path, ack_time)
+        except Exception as e:
+            self.error("Error following path %s: %s" % (command.path, str(e)))
+            command.completed.set_exception(e)
+        else:
+            command.completed.set_result(snapshot)
+
+    def wait_path(self, path, ack_time):
+        """
+        Follow a path in the published status until it completes.
+
+        The path starts when it is seen running, or when PATH_NAME shows it
+        after the acknowledgement (it ran between two status reads). A path
+        never seen within start_timeout ran entirely between two status
+        reads, or had nothing to do (e.g. home when the robot is already
+        home): the acknowledgement counts as its start and it is complete.
+
+        :param path: Name of the path.
+        :param ack_time: Time of the acknowledgement of the command. Older
+          snapshots are ignored.
+        :return: The first StatusSnapshot where the path is not running.
+        """
+        start = time.monotonic()
+        started = False
+        snapshot = self.acquisition.latest()
+        while not self._stop_event.is_set():
+            elapsed = time.monotonic() - start
+            if self.path_timeout is not None and \
+                    elapsed > self.path_timeout:
+                raise TimeoutError("Path %s did not complete" % path)
+
+            snapshot = self.acquisition.wait_newer(
+                snapshot, timeout=self.acquisition.max_period)
+            if snapshot is None or snapshot.timestamp <= ack_time:
+                continue
+            name_shown = snapshot.get('PATH_NAME', '').strip() == path
+            running = snapshot.get('PATH_RUNNING_1_0') and name_shown
+            if running and not started:
+                self.debug("Path %s started" % path)
+                started = True
+            elif not running and (started or name_shown):
+                self.debug("Path %s completed" % path)
+                return snapshot
+            elif not started and elapsed > self.start_timeout:
+                self.debug("Path %s not seen running, considered completed"
+                           % path)
+                return snapshot
+        raise RuntimeError("Trajectory executor stopped")
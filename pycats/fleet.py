@@ -0,0 +1,313 @@
+import selectors
+import socket
+import time
+from threading import Thread, Event, Lock
+
+from .acquisition import StatusAcquisition
+from .logger import get_logger
+from .stats import LatencyStats
+
+
+__all__ = ['FleetPoller']
+
+
+class _FleetMember:
+    """
+    A robot of the fleet and the status burst it has in flight.
+    """
+
+    def __init__(self, name, acquisition, window):
+        self.name = name
+        self.acquisition = acquisition
+        self.stats = LatencyStats(window)
+        self.deadline = time.monotonic()
+        self.removed = False
+
+        self.cmds = None
+        self.due = None
+        self.answers = []
+        self.sock = None
+        self.sent = None  # time the burst in flight was sent
+        self.expires = None  # time its answers must have arrived by
+
+
+class FleetPoller(Thread):
+    """
+    Poll the status of several CS8Connections from a single thread.
+
+    The status requests of every robot are sent as a pipelined burst on its
+    monitor socket and the answers are collected with a selector, so the
+    robots are read concurrently and the loop never blocks on one of them.
+    Each robot has its own StatusAcquisition, i.e. its own (adaptive)
+    period and its own published snapshots::
+
+        fleet = FleetPoller()
+        acq13 = fleet.add('bl13', CS8Connection(...), 0.05, 0.5)
+        acq06 = fleet.add('bl06', CS8Connection(...), 0.1)
+        fleet.start()
+        snapshot, changes, error = acq13.consume(timeout=1)
+        print(fleet.stats.summary())
+
+    A robot whose monitor socket is busy (e.g. a monitor() call from
+    another thread) is skipped until its next period. Disconnected robots
+    are not polled; reconnecting them is up to their owner.
+
+    :param stats_window: Number of latest polls kept for the percentiles of
+      the latency statistics.
+    """
+
+    def __init__(self, stats_window=1000):
+        Thread.__init__(self, name='FleetPoller')
+        self.daemon = True
+        logger = get_logger(__name__)
+        self.debug = logger.debug
+        self.error = logger.error
+
+        self.selector = selectors.DefaultSelector()
+        self.stats = LatencyStats(stats_window)
+        self._window = stats_window
+        self._members = {}
+        self._lock = Lock()
+        self._stop_event = Event()
+
+        # wakes up the selector when robots are added or removed
+        self._wakeup_r, self._wakeup_w = socket.socketpair()
+        self._wakeup_r.setblocking(False)
+        self._wakeup_w.setblocking(False)
+        self.selector.register(self._wakeup_r, selectors.EVENT_READ, None)
+
+    def add(self, name, cs8connection, period, max_period=None):
+        """
+        Add a robot to the fleet.
+
+        :param name: Name of the robot in the fleet.
+        :param cs8connection: Connected CS8Connection.
+        :param period: Acquisition period in seconds, see StatusAcquisition.
+        :param max_period: Maximum acquisition period in seconds.
+        :return: The StatusAcquisition publishing the status of the robot.
+        """
+        acquisition = StatusAcquisition(cs8connection, period, max_period)
+        with self._lock:
+            if name in self._members:
+                raise ValueError("Robot %s is already in the fleet" % name)
+            self._members[name] = _FleetMember(name, acquisition,
+                                               self._window)
+        self._wakeup()
+        return acquisition
+
+    def remove(self, name):
+        """
+        Remove a robot from the fleet. A status read in flight is completed
+        before the robot is dropped.
+
+        :param name: Name of the robot in the fleet.
+        :return: None
+        """
+        with self._lock:
+            self._members[name].removed = True
+        self._wakeup()
+
+    def names(self):
+        with self._lock:
+            return list(self._members)
+
+    def acquisition(self, name):
+        with self._lock:
+            return self._members[name].acquisition
+
+    def member_stats(self, name):
+        """
+        :return: The LatencyStats of one robot. The stats attribute of the
+          poller aggregates all of them.
+        """
+        with self._lock:
+            return self._members[name].stats
+
+    def snapshots(self):
+        """
+        :return: Dict name -> latest StatusSnapshot of each robot (None
+          until its first read).
+        """
+        with self._lock:
+            members = list(self._members.values())
+        return dict((member.name, member.acquisition.latest())
+                    for member in members)
+
+    def stop_running(self):
+        self._stop_event.set()
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self._wakeup_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # already pending, or the poller is closed
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                timeout = self._start_due_polls()
+                for key, _ in self.selector.select(timeout):
+                    if key.data is None:
+                        self._drain_wakeup()
+                    else:
+                        self._receive(key.data)
+                self._check_timeouts()
+        finally:
+            with self._lock:
+                members = list(self._members.values())
+            for member in members:
+                if member.sent is not None:
+                    self._finish_poll(member)
+            self.selector.close()
+            self._wakeup_r.close()
+            self._wakeup_w.close()
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _start_due_polls(self):
+        """
+        Send the status requests of the robots whose deadline has passed.
+
+        :return: Time in seconds until the next deadline.
+        """
+        now = time.monotonic()
+        next_wakeup = now + 1.
+        with self._lock:
+            members = list(self._members.values())
+        for member in members:
+            if member.sent is not None:
+                next_wakeup = min(next_wakeup, member.expires)
+                continue
+            if member.removed:
+                with self._lock:
+                    del self._members[member.name]
+                continue
+            if member.deadline <= now:
+                self._start_poll(member)
+                period = member.acquisition.period
+                member.deadline += period
+                if member.deadline < now:
+                    missed = int((now - member.deadline) / period) + 1
+                    member.deadline += missed * period
+            next_wakeup = min(next_wakeup, member.deadline)
+        return max(next_wakeup - time.monotonic(), 0.)
+
+    def _start_poll(self, member):
+        cs8connection = member.acquisition.cs8connection
+        if not cs8connection.connected or cs8connection.chan_mon is None:
+            return
+        if not cs8connection.lock_mon.acquire(False):
+            return  # the monitor socket is in use, wait for the next period
+
+        member.cmds, member.due = cs8connection._status_requests()
+        member.answers = []
+        member.sock = cs8connection.sock_mon
+        member.sent = time.monotonic()
+        member.expires = member.sent + max(
+            [cs8connection.get_command_deadline(cmd) for cmd in member.due],
+            default=0)
+        try:
+            if member.due:
+                cs8connection.chan_mon.send(member.due)
+                self.selector.register(member.sock, selectors.EVENT_READ,
+                                       member)
+            else:
+                self._complete(member)
+        except Exception as e:
+            self._fail(member, e)
+
+    def _receive(self, member):
+        channel = member.acquisition.cs8connection.chan_mon
+        try:
+            if channel.reader.fill(member.sock) == 0:
+                raise ConnectionError("Connection closed by CATS server")
+            while len(member.answers) < len(member.due):
+                reply = channel.next_reply()
+                if reply is None:
+                    return  # wait for the rest of the burst
+                member.answers.append(bytes(reply[1]))
+        except Exception as e:
+            self._fail(member, e)
+            return
+        self._complete(member)
+
+    def _finish_poll(self, member):
+        # read the rest of the burst blocking, so that no answer is left
+        # behind for the next user of the monitor socket
+        channel = member.acquisition.cs8connection.chan_mon
+        try:
+            while len(member.answers) < len(member.due):
+                member.answers.append(bytes(channel.receive()[1]))
+        except Exception as e:
+            self._fail(member, e)
+            return
+        self._complete(member)
+
+    def _check_timeouts(self):
+        now = time.monotonic()
+        with self._lock:
+            members = list(self._members.values())
+        for member in members:
+            if member.sent is not None and now > member.expires:
+                # the late answers are discarded; the link is only dead
+                # when earlier abandoned answers did not arrive either
+                channel = member.acquisition.cs8connection.chan_mon
+                slow = not channel.abandoned
+                channel.abandon()
+                self._fail(member, socket.timeout(
+                    "No status answer from CATS server"), lost=not slow)
+
+    def _end_poll(self, member, failed=False, lost=True):
+        """
+        :return: True if the poll failed but the monitor socket could be
+          replaced by the standby one.
+        """
+        try:
+            self.selector.unregister(member.sock)
+        except (KeyError, ValueError):
+            pass
+        member.sent = None
+        member.sock = None
+        cs8connection = member.acquisition.cs8connection
+        failover = False
+        if failed:
+            failover = cs8connection._failover_monitor()
+            if not failover and lost:
+                cs8connection._connection_lost()
+        cs8connection.lock_mon.release()
+        return failover
+
+    def _complete(self, member):
+        latency = time.monotonic() - member.sent
+        self._end_poll(member)
+        member.stats.add(latency)
+        self.stats.add(latency)
+
+        acquisition = member.acquisition
+        acquisition.cs8connection._record(member.due, member.answers)
+        try:
+            _, snapshot, changes = acquisition.cs8connection._process_status(
+                member.cmds, member.due, member.answers)
+        except Exception as e:
+            self.error("Exception when processing status of %s: %s" % (
+                member.name, str(e)))
+            acquisition.publish_error(e)
+            return
+        acquisition.publish(snapshot, changes)
+
+    def _fail(self, member, error, lost=True):
+        self.error("Exception when reading status of %s: %s" % (
+            member.name, str(error)))
+        member.stats.add_error()
+        self.stats.add_error()
+        if self._end_poll(member, failed=True, lost=lost):
+            # poll again right away on the standby socket
+            member.deadline = time.monotonic()
+            return
+        member.acquisition.publish_error(error)
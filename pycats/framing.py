@@ -0,0 +1,222 @@
+import socket
+import time
+from collections import deque
+
+
+__all__ = ['FrameReader', 'ReplyChannel', 'RequestCancelled', 'TERMINATOR']
+
+
+# Every request and every answer of the IRELEC server ends with a '\r'
+TERMINATOR = b'\r'
+
+# Longest time in seconds before a call waiting for an answer notices that
+# it was cancelled
+CANCEL_CHECK_PERIOD = 0.05
+
+
+class RequestCancelled(Exception):
+    """
+    The request was cancelled while waiting for its answer.
+    """
+
+
+class FrameReader:
+    """
+    Buffered reader for the stream of answers of the IRELEC server.
+
+    Data is received into a reusable buffer and split on the terminator.
+    A partial frame is kept in the buffer until the rest of it arrives with
+    a later read.
+    """
+
+    def __init__(self, size=4096):
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+
+    def reset(self):
+        """
+        Drop any buffered data (e.g. after a reconnection).
+        """
+        self._start = 0
+        self._end = 0
+
+    def buffered(self):
+        return self._end - self._start
+
+    def next_frame(self):
+        """
+        Extract the next complete frame from the buffered data.
+
+        :return: A memoryview of the frame without the terminator, or None if
+          there is no complete frame yet. The view is only valid until the
+          next call to fill().
+        """
+        idx = self._buf.find(TERMINATOR, self._start, self._end)
+        if idx < 0:
+            return None
+        frame = self._view[self._start:idx]
+        self._start = idx + 1
+        return frame
+
+    def fill(self, sock):
+        """
+        Receive once from the socket into the free space of the buffer.
+
+        :param sock: Socket to read from.
+        :return: Number of bytes received, 0 if the peer closed the connection.
+        """
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buf):
+            size = self._end - self._start
+            if self._start > 0:
+                # move the partial frame to the beginning of the buffer
+                self._buf[:size] = self._buf[self._start:self._end]
+            else:
+                # the partial frame fills the whole buffer: grow it
+                buf = bytearray(2 * len(self._buf))
+                buf[:size] = self._view[:size]
+                self._buf = buf
+                self._view = memoryview(buf)
+            self._start = 0
+            self._end = size
+        n = sock.recv_into(self._view[self._end:])
+        self._end += n
+        return n
+
+    def read_frame(self, sock):
+        """
+        Return the next frame, reading from the socket as much as needed.
+
+        :param sock: Socket to read from.
+        :return: A memoryview of the frame, see next_frame().
+        """
+        frame = self.next_frame()
+        while frame is None:
+            if self.fill(sock) == 0:
+                raise ConnectionError("Connection closed by CATS server")
+            frame = self.next_frame()
+        return frame
+
+
+class ReplyChannel:
+    """
+    One of the two sockets of the IRELEC server (operate or monitor) with
+    its frame reader and the list of requests waiting for an answer.
+
+    The server answers the requests in the order they were received, so each
+    frame read belongs to the oldest pending request. Requests whose caller
+    gave up (deadline passed or cancelled) stay in the queue as abandoned,
+    and their answers are discarded when they arrive.
+    """
+
+    def __init__(self, sock, size=4096):
+        self.sock = sock
+        self.timeout = sock.gettimeout()
+        self.reader = FrameReader(size)
+        self.pending = deque()
+        self.abandoned = 0  # oldest pending requests nobody waits for
+        self.cancelled = False
+
+    def reset(self):
+        self.reader.reset()
+        self.pending.clear()
+        self.abandoned = 0
+        self.cancelled = False
+
+    def abandon(self):
+        """
+        Give up the answers of all the pending requests. They are discarded
+        when they arrive.
+        """
+        self.abandoned = len(self.pending)
+
+    def cancel(self):
+        """
+        Make the call waiting in receive(), if any, raise RequestCancelled.
+        """
+        self.cancelled = True
+
+    def send(self, cmds):
+        """
+        Write one or several requests in a single send.
+
+        :param cmds: List of commands, without terminator.
+        :return: None
+        """
+        data = TERMINATOR.join(cmd.encode() for cmd in cmds) + TERMINATOR
+        self.cancelled = False
+        self.sock.sendall(data)
+        self.pending.extend(cmds)
+
+    def receive(self, deadline=None):
+        """
+        Read the next answer and match it with its request. The answers of
+        abandoned requests are skipped.
+
+        :param deadline: time.monotonic() value by which the answer must
+          arrive. None waits as long as the socket timeout.
+        :raises socket.timeout: The deadline passed.
+        :raises RequestCancelled: cancel() was called.
+        :return: Tuple (cmd, frame) where frame is a memoryview of the answer
+          as returned by FrameReader.next_frame().
+        """
+        while True:
+            if deadline is None:
+                frame = self.reader.read_frame(self.sock)
+            else:
+                frame = self._read_frame_until(deadline)
+            cmd = self.pending.popleft() if self.pending else None
+            if not self.abandoned:
+                return cmd, frame
+            self.abandoned -= 1
+
+    def _read_frame_until(self, deadline):
+        frame = self.reader.next_frame()
+        if frame is not None:
+            return frame
+        # wake up regularly to notice a cancellation. The timeout is only
+        # shortened again for the last wait before the deadline
+        timeout = CANCEL_CHECK_PERIOD
+        self.sock.settimeout(timeout)
+        try:
+            while frame is None:
+                if self.cancelled:
+                    raise RequestCancelled("Request cancelled")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise socket.timeout("No answer before the deadline")
+                if remaining < timeout:
+                    timeout = remaining
+                    self.sock.settimeout(timeout)
+                try:
+                    received = self.reader.fill(self.sock)
+                except socket.timeout:
+                    continue
+                if received == 0:
+                    raise ConnectionError("Connection closed by CATS server")
+                frame = self.reader.next_frame()
+        finally:
+            if timeout != self.timeout:
+                self.sock.settimeout(self.timeout)
+        return frame
+
+    def next_reply(self):
+        """
+        Match the next answer already buffered with its request, without
+        reading from the socket (for callers driving the socket with a
+        selector and FrameReader.fill()).
+
+        :return: Tuple (cmd, frame) as receive(), or None if no complete
+          answer is buffered.
+        """
+        while True:
+            frame = self.reader.next_frame()
+            if frame is None:
+                return None
+            cmd = self.pending.popleft() if self.pending else None
+            if not self.abandoned:
+                return cmd, frame
+            self.abandoned -= 1
@@ -0,0 +1,148 @@
+import time
+from threading import Lock
+
+
+__all__ = ['StatusHistory']
+
+
+class StatusHistory:
+    """
+    Fixed-capacity ring buffer of StatusSnapshot, ordered by timestamp,
+    with time-range queries in O(log n).
+
+    Consecutive snapshots share the fields whose answer did not change and
+    keep the di and do registers as integer bitmasks, so a snapshot costs
+    a few hundred bytes at most: 100000 snapshots (close to 3 hours of
+    100 ms polling) fit in a few tens of MB.
+
+    :param capacity: Number of snapshots kept. The oldest ones are dropped.
+    """
+
+    def __init__(self, capacity):
+        if capacity <= 0:
+            raise ValueError("The capacity must be positive")
+        self.capacity = capacity
+        self._snapshots = [None] * capacity
+        self._times = [0.] * capacity
+        self._start = 0
+        self._count = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return self._count
+
+    def clear(self):
+        with self._lock:
+            self._snapshots = [None] * self.capacity
+            self._start = 0
+            self._count = 0
+
+    def append(self, snapshot):
+        """
+        Add a snapshot, dropping the oldest one when the buffer is full.
+        A snapshot older than the latest one (e.g. after the system clock
+        was set back) is kept at the end with the latest timestamp.
+        """
+        with self._lock:
+            timestamp = snapshot.timestamp
+            if self._count:
+                timestamp = max(timestamp, self._times[self._last()])
+            if self._count < self.capacity:
+                i = (self._start + self._count) % self.capacity
+                self._count += 1
+            else:
+                i = self._start
+                self._start = (self._start + 1) % self.capacity
+            self._snapshots[i] = snapshot
+            self._times[i] = timestamp
+
+    def _last(self):
+        return (self._start + self._count - 1) % self.capacity
+
+    def _bisect(self, timestamp, right):
+        # first position whose time is > timestamp (right) or >= (left)
+        times = self._times
+        start = self._start
+        capacity = self.capacity
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            t = times[(start + mid) % capacity]
+            if timestamp < t or (not right and timestamp == t):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def _slice(self, lo, hi):
+        start = self._start
+        capacity = self.capacity
+        return [self._snapshots[(start + i) % capacity]
+                for i in range(lo, hi)]
+
+    def latest(self):
+        """
+        :return: The latest snapshot, or None.
+        """
+        with self._lock:
+            if not self._count:
+                return None
+            return self._snapshots[self._last()]
+
+    def at(self, timestamp):
+        """
+        :return: The snapshot in effect at timestamp, i.e. the latest one
+          taken at or before it, or None.
+        """
+        with self._lock:
+            i = self._bisect(timestamp, right=True)
+            if i == 0:
+                return None
+            return self._snapshots[(self._start + i - 1) % self.capacity]
+
+    def between(self, start, end=None):
+        """
+        :param start: Timestamp of the beginning of the range.
+        :param end: Timestamp of the end of the range (None for no limit).
+        :return: List of the snapshots taken between start and end
+          (included), oldest first.
+        """
+        with self._lock:
+            lo = self._bisect(start, right=False)
+            if end is None:
+                hi = self._count
+            else:
+                hi = self._bisect(end, right=True)
+            return self._slice(lo, max(lo, hi))
+
+    def since(self, seconds, now=None):
+        """
+        :param seconds: Length of the range.
+        :param now: End of the range (default time.time()).
+        :return: List of the snapshots of the last seconds, oldest first.
+        """
+        if now is None:
+            now = time.time()
+        return self.between(now - seconds, now)
+
+    def deltas(self, start, end=None):
+        """
+        Changes between consecutive snapshots of a time range.
+
+        :return: List of tuples (timestamp, changes), changes mapping each
+          changed key to (old_value, new_value). The first entry holds the
+          whole snapshot in effect at start.
+        """
+        snapshots = self.between(start, end)
+        previous = self.at(start)
+        if previous is not None and (
+                not snapshots or previous is not snapshots[0]):
+            snapshots.insert(0, previous)
+        result = []
+        previous = None
+        for snapshot in snapshots:
+            changes = snapshot.diff(previous)
+            if changes or previous is None:
+                result.append((snapshot.timestamp, changes))
+            previous = snapshot
+        return result
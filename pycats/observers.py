@@ -0,0 +1,224 @@
+from collections import deque
+from threading import Thread, Condition, Lock
+
+from .logger import get_logger
+from .status import (FIELD_STATE, FIELD_DI, FIELD_DO, FIELD_POSITION,
+                     FIELD_MESSAGE, FIELD_CONFIG)
+
+
+__all__ = ['StatusDispatcher', 'Subscription', 'GROUPS']
+
+
+# Key groups a callback can subscribe to, by field of the StatusSnapshot
+GROUPS = {
+    'state': FIELD_STATE,
+    'di': FIELD_DI,
+    'do': FIELD_DO,
+    'position': FIELD_POSITION,
+    'message': FIELD_MESSAGE,
+    'config': FIELD_CONFIG,
+}
+
+
+class Subscription:
+    """
+    A callback registered in a StatusDispatcher.
+
+    :ivar keys: Status keys observed, or None.
+    :ivar group: Key group observed (one of GROUPS), or None.
+    :ivar errors: Number of exceptions raised by the callback.
+    """
+
+    def __init__(self, callback, keys=None, group=None):
+        self.callback = callback
+        self.keys = frozenset(keys) if keys is not None else None
+        self.group = group
+        self.errors = 0
+
+    def __repr__(self):
+        return 'Subscription(%r, keys=%r, group=%r)' % (
+            self.callback, self.keys and sorted(self.keys), self.group)
+
+
+class StatusDispatcher(Thread):
+    """
+    Call the subscribed callbacks with the changes of the status, from a
+    thread of its own.
+
+    The acquisition loop only queues the changes with publish(), which
+    never blocks: when max_pending changes are waiting, the new ones are
+    merged into the latest queued entry, so a slow callback delays the
+    notifications without stalling the polling or losing changes. The
+    callbacks share the thread of the dispatcher and should return quickly.
+
+    Each callback is called as callback(snapshot, changes) with the
+    StatusSnapshot and the dict key -> (old_value, new_value) of the
+    changes it observes. The first snapshot published is the initial
+    state, not a change, and is not notified.
+
+    :param layout: StatusLayout of the snapshots.
+    :param max_pending: Number of changes queued before merging them.
+    """
+
+    def __init__(self, layout, max_pending=100):
+        Thread.__init__(self, name='StatusDispatcherThread')
+        self.daemon = True
+        logger = get_logger(__name__)
+        self.error = logger.error
+
+        self.layout = layout
+        self.max_pending = max_pending
+        self.merged = 0  # changes merged because the queue was full
+        self.snapshot = None  # latest snapshot published
+
+        self._pending = deque()
+        self._cond = Condition(Lock())
+        self._running = True
+
+        self._subscriptions = []
+        self._by_key = {}
+        self._by_field = {}
+        self._any = []
+
+    def subscribe(self, callback, keys=None, group=None):
+        """
+        Register a callback for the changes of some keys, of a key group,
+        or of any key when neither is given.
+
+        :param callback: Callable(snapshot, changes).
+        :param keys: Iterable of status keys.
+        :param group: One of 'state', 'di', 'do', 'position', 'message',
+          'config'.
+        :return: The Subscription, to be passed to unsubscribe().
+        """
+        if keys is not None and group is not None:
+            raise ValueError("Subscribe either to keys or to a group")
+        if group is not None and group not in GROUPS:
+            raise ValueError("Unknown key group %s" % group)
+        if isinstance(keys, str):
+            keys = [keys]
+        subscription = Subscription(callback, keys, group)
+        if subscription.keys is not None:
+            unknown = sorted(subscription.keys.difference(self.layout.index))
+            if unknown:
+                raise ValueError(
+                    "Unknown status key(s): %s" % ", ".join(unknown))
+
+        with self._cond:
+            self._subscriptions.append(subscription)
+            self._index()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._cond:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+                self._index()
+
+    def subscriptions(self):
+        return list(self._subscriptions)
+
+    def _index(self):
+        # rebuilt on (un)subscription, read by the dispatch without lock
+        by_key = {}
+        by_field = {}
+        any_change = []
+        for subscription in self._subscriptions:
+            if subscription.keys is not None:
+                for key in subscription.keys:
+                    by_key.setdefault(key, []).append(subscription)
+            elif subscription.group is not None:
+                by_field.setdefault(
+                    GROUPS[subscription.group], []).append(subscription)
+            else:
+                any_change.append(subscription)
+        self._by_key = by_key
+        self._by_field = by_field
+        self._any = any_change
+
+    def publish(self, snapshot, changes=None):
+        """
+        Queue the changes of a new snapshot. Never blocks.
+
+        :param snapshot: StatusSnapshot.
+        :param changes: Dict key -> (old_value, new_value) of the changes
+          since the previous snapshot published, or None to compute them
+          (e.g. when the connection lost its previous snapshot).
+        """
+        previous = self.snapshot
+        self.snapshot = snapshot
+        if previous is None or previous.layout is not snapshot.layout:
+            return
+        if changes is None:
+            changes = snapshot.diff(previous)
+        if not changes:
+            return
+        with self._cond:
+            if len(self._pending) < self.max_pending or not self._pending:
+                self._pending.append((snapshot, dict(changes)))
+            else:
+                _, merged = self._pending.pop()
+                for key, (old, new) in changes.items():
+                    if key in merged:
+                        old = merged[key][0]
+                    if old == new:
+                        merged.pop(key, None)
+                    else:
+                        merged[key] = (old, new)
+                self._pending.append((snapshot, merged))
+                self.merged += 1
+            self._cond.notify()
+
+    def pending(self):
+        return len(self._pending)
+
+    def reset(self):
+        """
+        Forget the latest snapshot: the next one published is taken as the
+        initial state.
+        """
+        self.snapshot = None
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                snapshot, changes = self._pending.popleft()
+            if changes:
+                self.dispatch(snapshot, changes)
+
+    def dispatch(self, snapshot, changes):
+        """
+        Call the callbacks observing some of the changes.
+        """
+        index = self.layout.index
+        by_key = self._by_key
+        by_field = self._by_field
+
+        observed = {}
+        for key in changes:
+            for subscription in by_key.get(key, ()):
+                observed.setdefault(subscription, {})[key] = changes[key]
+            field = index.get(key, (None,))[0]
+            for subscription in by_field.get(field, ()):
+                observed.setdefault(subscription, {})[key] = changes[key]
+        for subscription in self._any:
+            observed[subscription] = changes
+
+        for subscription, subscription_changes in observed.items():
+            try:
+                subscription.callback(snapshot, subscription_changes)
+            except Exception as e:
+                subscription.errors += 1
+                self.error("Error in status callback %r: %s" %
+                           (subscription.callback, str(e)))
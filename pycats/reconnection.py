@@ -0,0 +1,145 @@
+import random
+import time
+from threading import Thread, Event
+
+from .logger import get_logger
+
+
+__all__ = ['Reconnection', 'STATE_CONNECTED', 'STATE_DISCONNECTED',
+           'STATE_CONNECTING', 'STATE_BACKOFF', 'STATE_FAILED']
+
+
+# Connection states
+STATE_CONNECTED = 'CONNECTED'
+STATE_DISCONNECTED = 'DISCONNECTED'
+STATE_CONNECTING = 'CONNECTING'  # attempt in progress
+STATE_BACKOFF = 'BACKOFF'  # waiting for the next attempt
+STATE_FAILED = 'FAILED'  # reconnection timeout reached
+
+
+class Reconnection:
+    """
+    Reconnect a CS8Connection from a background thread when its
+    connection is lost.
+
+    The first failed attempt is retried immediately. After that the wait
+    between attempts starts at interval and doubles up to max_interval,
+    minus a random jitter so that several clients do not retry in lockstep.
+    When the connection is not back after timeout seconds the reconnection
+    gives up and check() raises RuntimeError, as CS8Connection.reconnect()
+    does.
+
+    :param cs8connection: CS8Connection to keep connected.
+    :param interval: Wait in seconds after the second failed attempt.
+    :param timeout: Seconds since the connection was lost after which the
+      reconnection gives up.
+    :param max_interval: Longest wait in seconds between attempts. Defaults
+      to 8 times interval.
+    :param jitter: Fraction of the wait that is random (0 to 1).
+    """
+
+    def __init__(self, cs8connection, interval=5, timeout=30,
+                 max_interval=None, jitter=0.5):
+        logger = get_logger(__name__)
+        self.debug = logger.debug
+        self.info = logger.info
+        self.error = logger.error
+
+        self.cs8connection = cs8connection
+        self.interval = interval
+        self.timeout = timeout
+        self.max_interval = max_interval or 8 * interval
+        self.jitter = jitter
+
+        if cs8connection.connected:
+            self.state = STATE_CONNECTED
+        else:
+            self.state = STATE_DISCONNECTED
+        self.attempts = 0  # attempts since the object creation
+        self.failures = 0  # consecutive failed attempts
+        self.reconnections = 0  # successful reconnections
+        self.last_error = None
+        self.lost_since = None
+        self.next_attempt = None
+
+        self._thread = None
+        self._stop_event = Event()
+
+    def check(self):
+        """
+        Start the reconnection if the connection is lost. Never blocks, so
+        it can be called from a control loop.
+
+        :raises RuntimeError: The reconnection timeout was reached.
+        :return: The connection state.
+        """
+        if self.state == STATE_FAILED:
+            raise RuntimeError("Reconnection timeout, aborting...")
+        if self._thread is not None and self._thread.is_alive():
+            return self.state
+        if self.cs8connection.connected:
+            self.state = STATE_CONNECTED
+            return self.state
+
+        self.debug("Trying to reconnect...")
+        self.state = STATE_DISCONNECTED
+        self.lost_since = time.time()
+        self.failures = 0
+        self._stop_event.clear()
+        self._thread = Thread(target=self._run, name='ReconnectionThread')
+        self._thread.daemon = True
+        self._thread.start()
+        return self.state
+
+    def stop(self):
+        """
+        Stop the reconnection attempts, if any.
+        """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def next_delay(self):
+        """
+        :return: Wait in seconds before the next attempt, after
+          self.failures consecutive failed attempts.
+        """
+        if self.failures <= 1:
+            return 0.
+        delay = min(self.interval * 2 ** (self.failures - 2),
+                    self.max_interval)
+        return delay * (1 - self.jitter * random.random())
+
+    def _run(self):
+        cs8 = self.cs8connection
+        while not self._stop_event.is_set():
+            if time.time() - self.lost_since > self.timeout:
+                self.error("Reconnection timeout, aborting...")
+                self.state = STATE_FAILED
+                return
+
+            self.state = STATE_CONNECTING
+            self.attempts += 1
+            try:
+                cs8.disconnect()
+                cs8.connect(cs8.host, cs8.operate_port, cs8.monitor_port)
+            except Exception as e:
+                self.last_error = e
+                self.failures += 1
+                delay = self.next_delay()
+                self.error("Error trying to reconnect: %s" % str(e))
+                self.debug("Next reconnection attempt in %.1f seconds." %
+                           delay)
+                self.next_attempt = time.time() + delay
+                self.state = STATE_BACKOFF
+                self._stop_event.wait(delay)
+                continue
+
+            self.info("Reconnected to CATS server after %d attempt(s)" %
+                      (self.failures + 1))
+            self.reconnections += 1
+            self.failures = 0
+            self.next_attempt = None
+            self.state = STATE_CONNECTED
+            return
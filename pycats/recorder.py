@@ -0,0 +1,218 @@
+import mmap
+import os
+import struct
+import time
+from collections import deque
+from threading import Thread, Event
+
+from .logger import get_logger
+
+
+__all__ = ['MonitorRecorder', 'read_records', 'list_recordings', 'MAGIC']
+
+
+# A recording file starts with MAGIC, followed by one record per exchange
+# on the monitor socket:
+#   RECORD: size of the rest of the record, timestamp, number of replies
+#   then for each reply ITEM: length of the command, length of the reply
+#   then for each reply the command and the raw reply
+MAGIC = b'PYCATS\x00\x01'
+RECORD = struct.Struct('<IdH')
+ITEM = struct.Struct('<HI')
+EXTENSION = '.rec'
+
+
+def _encode(timestamp, cmds, answers):
+    items = []
+    data = []
+    for cmd, answer in zip(cmds, answers):
+        cmd = cmd.encode()
+        if isinstance(answer, str):
+            answer = answer.encode()
+        items.append(ITEM.pack(len(cmd), len(answer)))
+        data.append(cmd)
+        data.append(answer)
+    body = b''.join(items + data)
+    return RECORD.pack(len(body) + RECORD.size - 4, timestamp,
+                       len(items)) + body
+
+
+class MonitorRecorder(Thread):
+    """
+    Append-only recorder of the raw replies of the monitor socket.
+
+    record() only queues the replies, so the polling never waits for the
+    disk: a background thread writes the queued records every
+    flush_period, in files of the directory named
+    <prefix>-<date>-<time>-<sequence>.rec. A new file is started when the
+    current one reaches max_bytes or is max_age seconds old. The files can
+    be read with read_records().
+
+    :param directory: Directory of the files, created if needed.
+    :param prefix: Prefix of the file names.
+    :param max_bytes: Size of a file that triggers the rotation.
+    :param max_age: Age in seconds of a file that triggers the rotation.
+    :param max_files: Number of files kept, the oldest being deleted
+      (None to keep them all).
+    :param flush_period: Time in seconds between writes.
+    :param max_pending: Number of queued records above which the new
+      records are dropped (e.g. when the disk is too slow).
+    """
+
+    def __init__(self, directory, prefix='monitor', max_bytes=64 << 20,
+                 max_age=3600, max_files=None, flush_period=0.5,
+                 max_pending=100000):
+        Thread.__init__(self, name='MonitorRecorderThread')
+        self.daemon = True
+        logger = get_logger(__name__)
+        self.debug = logger.debug
+        self.error = logger.error
+
+        self.directory = directory
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.max_files = max_files
+        self.flush_period = flush_period
+        self.max_pending = max_pending
+
+        self.records = 0  # records written
+        self.dropped = 0  # records dropped because the queue was full
+        self.files = 0  # files created
+        self.path = None  # current file
+
+        self._pending = deque()
+        self._file = None
+        self._file_size = 0
+        self._file_time = None
+        self._stop_event = Event()
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, timestamp, cmds, answers):
+        """
+        Queue the replies of an exchange on the monitor socket. Never
+        blocks.
+
+        :param timestamp: Time when the replies were received.
+        :param cmds: List of commands.
+        :param answers: List of their raw replies, as bytes or str.
+        """
+        if len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self._pending.append((timestamp, cmds, answers))
+
+    def stop(self):
+        """
+        Write the queued records and close the file.
+        """
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        try:
+            while not self._stop_event.wait(self.flush_period):
+                self.flush()
+            self.flush()
+        finally:
+            self._close()
+
+    def flush(self):
+        """
+        Write the queued records, rotating the file when needed.
+        """
+        pending = self._pending
+        chunks = []
+        while pending:
+            chunks.append(_encode(*pending.popleft()))
+        if not chunks:
+            return
+        try:
+            if self._file is None or self._rotation_due():
+                self._open()
+            data = b''.join(chunks)
+            self._file.write(data)
+            self._file.flush()
+            self._file_size += len(data)
+            self.records += len(chunks)
+        except Exception as e:
+            self.error("Error writing the monitor recording: %s" % str(e))
+            self._close()
+
+    def _rotation_due(self):
+        return self._file_size >= self.max_bytes or \
+            time.time() - self._file_time >= self.max_age
+
+    def _open(self):
+        self._close()
+        now = time.time()
+        name = '%s-%s-%04d%s' % (
+            self.prefix, time.strftime('%Y%m%d-%H%M%S', time.localtime(now)),
+            self.files, EXTENSION)
+        self.path = os.path.join(self.directory, name)
+        self._file = open(self.path, 'wb')
+        self._file.write(MAGIC)
+        self._file_size = len(MAGIC)
+        self._file_time = now
+        self.files += 1
+        self.debug("Recording the monitor replies in %s" % self.path)
+
+        if self.max_files:
+            paths = list_recordings(self.directory, self.prefix)
+            for path in paths[:-self.max_files]:
+                os.remove(path)
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+
+
+def list_recordings(directory, prefix='monitor'):
+    """
+    :return: Paths of the recording files of a directory, oldest first.
+    """
+    names = [name for name in os.listdir(directory)
+             if name.startswith(prefix + '-') and name.endswith(EXTENSION)]
+    paths = [os.path.join(directory, name) for name in names]
+    return sorted(paths, key=lambda path: (os.path.getmtime(path), path))
+
+
+def read_records(path):
+    """
+    Read a recording file through a memory map. A record truncated at the
+    end of the file (e.g. by a crash) is ignored.
+
+    :param path: Path of the file.
+    :return: Generator of tuples (timestamp, cmds, answers), cmds being a
+      list of str and answers a list of bytes.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < len(MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError("%s is not a monitor recording" % path)
+            offset = len(MAGIC)
+            while offset + RECORD.size <= size:
+                length, timestamp, count = RECORD.unpack_from(data, offset)
+                end = offset + 4 + length
+                if end > size:
+                    break
+                position = offset + RECORD.size
+                lengths = []
+                for _ in range(count):
+                    lengths.append(ITEM.unpack_from(data, position))
+                    position += ITEM.size
+                cmds = []
+                answers = []
+                for cmd_length, answer_length in lengths:
+                    cmds.append(
+                        data[position:position + cmd_length].decode())
+                    position += cmd_length
+                    answers.append(data[position:position + answer_length])
+                    position += answer_length
+                yield timestamp, cmds, answers
+                offset = end
@@ -0,0 +1,286 @@
+import itertools
+import os
+import time
+from collections import deque
+from threading import Event
+
+import click
+
+from .logger import get_logger
+from .recorder import list_recordings, read_records
+from .stats import LatencyStats
+
+
+__all__ = ['Replay', 'ReplayChannel', 'ReplayOperateChannel',
+           'read_recordings']
+
+
+def read_recordings(path):
+    """
+    :param path: Recording file, directory of recording files, or list of
+      recording files.
+    :return: Generator of the records (timestamp, cmds, answers) of all the
+      files, in order.
+    """
+    if isinstance(path, (list, tuple)):
+        paths = path
+    elif os.path.isdir(path):
+        paths = list_recordings(path)
+    else:
+        paths = [path]
+    return itertools.chain.from_iterable(read_records(p) for p in paths)
+
+
+class ReplayChannel:
+    """
+    Stands for the ReplyChannel of the monitor socket, answering each
+    request with the latest recorded reply of the same command.
+
+    With a speed, the recording is played in real time (speed 1) or N times
+    faster (speed N): a request gets the replies recorded up to the elapsed
+    replay time, as the robot would have answered at that moment. Without a
+    speed, each burst of requests moves to the next record, so the replay
+    runs as fast as possible and always yields the same sequence of
+    answers.
+
+    :param records: Iterable of records (timestamp, cmds, answers), see
+      recorder.read_records().
+    :param speed: Replay speed, None or 0 for as fast as possible.
+    """
+
+    def __init__(self, records, speed=1.):
+        self.speed = speed
+        self.answers = {}  # latest recorded reply of each command
+        self.timestamp = None  # recorded time of the replies served
+        self.records = 0  # records played
+        self.finished = Event()
+        self.abandoned = 0
+
+        self._records = iter(records)
+        self._next = next(self._records, None)
+        self._origin = None  # (monotonic time, recorded time) of the start
+        self._pending = deque()
+        if self._next is None:
+            self.finished.set()
+
+    def clock(self):
+        """
+        :return: Recorded time of the replies served, to be used as the
+          clock of the CS8Connection.
+        """
+        if self.timestamp is None:
+            return time.time()
+        return self.timestamp
+
+    def _advance(self):
+        timestamp, cmds, answers = self._next
+        for cmd, answer in zip(cmds, answers):
+            self.answers[cmd] = bytes(answer)
+        self.timestamp = timestamp
+        self.records += 1
+        self._next = next(self._records, None)
+        if self._next is None:
+            self.finished.set()
+
+    def _replay_time(self):
+        start, recorded_start = self._origin
+        return recorded_start + (time.monotonic() - start) * self.speed
+
+    def send(self, cmds):
+        if self._next is not None:
+            if not self.speed:
+                self._advance()
+            else:
+                if self._origin is None:
+                    self._origin = (time.monotonic(), self._next[0])
+                now = self._replay_time()
+                while self._next is not None and self._next[0] <= now:
+                    self._advance()
+        # commands not recorded yet are taken from the next records
+        while self._next is not None and \
+                any(cmd not in self.answers for cmd in cmds):
+            self._advance()
+
+        for cmd in cmds:
+            if cmd not in self.answers:
+                raise ValueError("No recorded reply for %s" % cmd)
+            self._pending.append((cmd, self.answers[cmd]))
+
+    def receive(self, deadline=None):
+        return self._pending.popleft()
+
+    def next_reply(self):
+        if not self._pending:
+            return None
+        return self._pending.popleft()
+
+    def reset(self):
+        self._pending.clear()
+
+    def abandon(self):
+        self._pending.clear()
+
+    def cancel(self):
+        pass
+
+
+class ReplayOperateChannel:
+    """
+    Stands for the ReplyChannel of the operate socket during a replay: the
+    commands are not sent anywhere, they are kept in sent and answered with
+    their own name.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.sent = []  # (timestamp, cmd)
+        self.abandoned = 0
+        self._pending = deque()
+
+    def send(self, cmds):
+        for cmd in cmds:
+            self.sent.append((self.clock(), cmd))
+            self._pending.append((cmd, cmd.encode()))
+
+    def receive(self, deadline=None):
+        return self._pending.popleft()
+
+    def reset(self):
+        self._pending.clear()
+
+    def abandon(self):
+        self._pending.clear()
+
+    def cancel(self):
+        pass
+
+
+class Replay:
+    """
+    Drive a CS8Connection with recorded monitor replies instead of a
+    robot, see recorder.MonitorRecorder.
+
+    Once attached, the status pipeline of the connection (parsing,
+    snapshots, path safe and recovery logic, conditions, callbacks,
+    history) runs on the recorded replies and with the recorded
+    timestamps, whoever polls it (run(), a StatusAcquisition, the Tango
+    device). The operate commands are not sent, see ReplayOperateChannel.
+    Replayed as fast as possible, a recording always gives the same
+    sequence of snapshots. ::
+
+        replay = Replay(cs8, '/var/log/pycats', speed=None)
+        replay.attach()
+        print(replay.run())
+
+    :param cs8connection: CS8Connection to drive. It must not be connected.
+    :param path: Recording file, directory of recording files, or list of
+      recording files.
+    :param speed: Replay speed (1 for real time), None or 0 for as fast as
+      possible.
+    """
+
+    def __init__(self, cs8connection, path, speed=1.):
+        logger = get_logger(__name__)
+        self.info = logger.info
+
+        self.cs8connection = cs8connection
+        self.path = path
+        self.channel = ReplayChannel(read_recordings(path), speed)
+        self.operate_channel = ReplayOperateChannel(self.channel.clock)
+        self.stats = LatencyStats(10000)  # time spent in each status cycle
+        self.elapsed = 0.
+
+    @property
+    def finished(self):
+        return self.channel.finished.is_set()
+
+    def attach(self):
+        """
+        Replace the sockets of the connection by the replay channels. The
+        status is read in bursts, one record per burst.
+        """
+        cs8 = self.cs8connection
+        if cs8.sock_op is not None or cs8.sock_mon is not None:
+            raise RuntimeError("Disconnect before replaying a recording")
+        cs8.set_pipelined(True)
+        cs8.chan_mon = self.channel
+        cs8.chan_op = self.operate_channel
+        cs8.clock = self.channel.clock
+        cs8.connected = True
+        self.info("Replaying %s" % self.path)
+
+    def detach(self):
+        cs8 = self.cs8connection
+        cs8.connected = False
+        cs8.chan_mon = None
+        cs8.chan_op = None
+        cs8.clock = time.time
+
+    def run(self, max_cycles=None, callback=None):
+        """
+        Read the status of the connection in a loop until the end of the
+        recording.
+
+        :param max_cycles: Maximum number of status reads.
+        :param callback: Called as callback(timestamp, snapshot, changes)
+          after each status read.
+        :return: The summary of the replay, see summary().
+        """
+        cs8 = self.cs8connection
+        started = time.perf_counter()
+        cycles = 0
+        while not self.finished:
+            if max_cycles is not None and cycles >= max_cycles:
+                break
+            start = time.perf_counter()
+            timestamp, snapshot, changes = cs8._update_status()
+            self.stats.add(time.perf_counter() - start)
+            if callback is not None:
+                callback(timestamp, snapshot, changes)
+            cycles += 1
+        self.elapsed = time.perf_counter() - started
+        return self.summary()
+
+    def summary(self):
+        """
+        :return: Dict with the number of records and status cycles played,
+          the elapsed time, the cycles per second and the statistics of the
+          time in seconds spent in each cycle.
+        """
+        summary = self.stats.summary()
+        cycles = summary['count']
+        return {
+            'records': self.channel.records,
+            'cycles': cycles,
+            'elapsed': self.elapsed,
+            'cycles_per_s': cycles / self.elapsed if self.elapsed else 0.,
+            'cycle': summary,
+        }
+
+
+@click.command()
+@click.argument('path', type=click.Path(exists=True))
+@click.option('--speed', type=click.FLOAT, default=0.,
+              help='Replay speed, 1 for real time, 0 for as fast as possible')
+@click.option('--model', type=click.STRING, default='cats',
+              help='Model of the recorded robot (cats or isara)')
+def run(path, speed, model):
+    """
+    Replay a monitor recording through the status pipeline and print the
+    throughput.
+    """
+    from .core import CS8Connection
+    cs8 = CS8Connection()
+    cs8.set_model(model)
+    replay = Replay(cs8, path, speed)
+    replay.attach()
+    summary = replay.run()
+    cycle = summary['cycle']
+    print('%(records)d records, %(cycles)d status cycles in %(elapsed).3f s '
+          '(%(cycles_per_s).0f cycles/s)' % summary)
+    print('cycle time (us): mean %.1f p50 %.1f p99 %.1f max %.1f' % tuple(
+        1e6 * cycle[key] for key in ('mean', 'p50', 'p99', 'max')))
+
+
+if __name__ == '__main__':
+    run()
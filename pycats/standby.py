@@ -0,0 +1,105 @@
+from threading import Thread, Event, Lock
+
+from .framing import ReplyChannel
+from .logger import get_logger
+
+
+__all__ = ['MonitorStandby']
+
+
+class MonitorStandby(Thread):
+    """
+    Spare monitor socket of a CS8Connection, kept connected and
+    health-checked in the background so it can replace the monitor socket
+    as soon as it fails.
+
+    Every check_period the spare socket is opened if there is none, or
+    checked with a 'message' request otherwise. A socket failing its check
+    is closed and a new one is opened at the next check.
+
+    :param cs8connection: CS8Connection owning the spare socket.
+    :param check_period: Period of the health check in seconds.
+    """
+
+    def __init__(self, cs8connection, check_period):
+        Thread.__init__(self, name='MonitorStandbyThread')
+        self.daemon = True
+        logger = get_logger(__name__)
+        self.debug = logger.debug
+        self.warn = logger.warning
+
+        self.cs8connection = cs8connection
+        self.check_period = check_period
+        self.sock = None
+        self.chan = None
+        self.healthy = False
+        self.swaps = 0
+        self.failed_checks = 0
+
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._stop_event = Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wakeup.set()
+        if self.is_alive():
+            self.join()
+        with self._lock:
+            self._close()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            if self.cs8connection.connected:
+                self.check()
+            self._wakeup.wait(self.check_period)
+            self._wakeup.clear()
+
+    def check(self):
+        """
+        Open the spare socket if needed and check that it answers.
+
+        :return: True if the spare socket is healthy.
+        """
+        with self._lock:
+            try:
+                if self.sock is None:
+                    self.sock = self.cs8connection._open_socket(
+                        self.cs8connection.monitor_port)
+                    self.chan = ReplyChannel(self.sock)
+                    self.debug("Standby monitor socket created")
+                self.chan.send(['message'])
+                self.chan.receive()
+                self.healthy = True
+            except Exception as e:
+                self.warn("Standby monitor socket check failed: %s" % str(e))
+                self.failed_checks += 1
+                self._close()
+            return self.healthy
+
+    def take(self):
+        """
+        Hand over the spare socket. A new one is opened right away in the
+        background.
+
+        :return: Tuple (sock, chan), or None if there is no healthy spare
+          socket.
+        """
+        # waits for a health check in progress, one round trip normally
+        with self._lock:
+            if not self.healthy:
+                return None
+            spare = self.sock, self.chan
+            self.sock = None
+            self.chan = None
+            self.healthy = False
+            self.swaps += 1
+        self._wakeup.set()
+        return spare
+
+    def _close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+        self.chan = None
+        self.healthy = False
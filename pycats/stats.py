@@ -0,0 +1,59 @@
+from collections import deque
+from threading import Lock
+
+
+__all__ = ['LatencyStats']
+
+
+class LatencyStats:
+    """
+    Latency statistics (e.g. of the status polls or of the stop commands):
+    totals since the start and percentiles over the latest samples.
+
+    :param window: Number of latest samples kept for the percentiles.
+    """
+
+    def __init__(self, window=1000):
+        self._lock = Lock()
+        self.latencies = deque(maxlen=window)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.
+        self.max = 0.
+        self.last = 0.
+
+    def add(self, latency):
+        with self._lock:
+            self.latencies.append(latency)
+            self.count += 1
+            self.total += latency
+            self.last = latency
+            if latency > self.max:
+                self.max = latency
+
+    def add_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def summary(self):
+        """
+        :return: Dict with the number of samples and of errors, the mean
+          and max latency since the start, the last latency and the p50, p95 and p99
+          latencies of the window. Latencies in seconds.
+        """
+        with self._lock:
+            window = sorted(self.latencies)
+            summary = {
+                'count': self.count,
+                'errors': self.errors,
+                'mean': self.total / self.count if self.count else 0.,
+                'max': self.max,
+                'last': self.last,
+            }
+        for name, quantile in (('p50', .5), ('p95', .95), ('p99', .99)):
+            if window:
+                i = min(int(quantile * len(window)), len(window) - 1)
+                summary[name] = window[i]
+            else:
+                summary[name] = 0.
+        return summary
@@ -0,0 +1,218 @@
+from collections.abc import Mapping
+
+
+__all__ = ['StatusLayout', 'StatusSnapshot']
+
+
+# Fields of a status snapshot
+FIELD_STATE, FIELD_DI, FIELD_DO, FIELD_POSITION, FIELD_MESSAGE, \
+    FIELD_CONFIG = range(6)
+
+
+def _iter_bits(mask):
+    """
+    Yield the positions of the bits set in mask, lowest first.
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class StatusLayout:
+    """
+    Fixed offsets of the status keys inside a StatusSnapshot, for one
+    model. A layout is built once per model and shared by all its snapshots.
+
+    :param state_keys: For each column of the state answer, the tuple of keys
+      holding its value (more than one key for the ISARA aliases).
+    :param di_bits: Dict bit position -> key of the di register.
+    :param do_bits: Dict bit position -> key of the do register.
+    :param position_keys: Key of each column of the position answer.
+    :param message_key: Key of the message answer.
+    :param config_key: Key of the config answer.
+    """
+
+    def __init__(self, state_keys, di_bits, do_bits, position_keys,
+                 message_key='MESSAGE', config_key='CONFIG'):
+        self.state_keys = [tuple(keys) for keys in state_keys]
+        self.di_bits = dict(di_bits)
+        self.do_bits = dict(do_bits)
+        self.position_keys = list(position_keys)
+        self.message_key = message_key
+        self.config_key = config_key
+
+        self.index = {}
+        for i, keys in enumerate(self.state_keys):
+            for key in keys:
+                self.index[key] = (FIELD_STATE, i)
+        for i, key in sorted(self.di_bits.items()):
+            self.index[key] = (FIELD_DI, i)
+        for i, key in sorted(self.do_bits.items()):
+            self.index[key] = (FIELD_DO, i)
+        for i, key in enumerate(self.position_keys):
+            self.index[key] = (FIELD_POSITION, i)
+        self.index[message_key] = (FIELD_MESSAGE, 0)
+        self.index[config_key] = (FIELD_CONFIG, 0)
+
+
+class StatusSnapshot(Mapping):
+    """
+    Immutable status of the CATS system at a given time.
+
+    The values are kept in typed fields: the state and position answers as
+    tuples of converted values, the di and do registers as integer bitmasks
+    (with the number of bits received), the message and the config answer
+    (None unless it is polled) as strings. The snapshot can be used as a
+    read-only dict keyed by the names of state_params, di_params,
+    do_params, position_params, 'MESSAGE' and 'CONFIG'.
+
+    Fields whose answer did not change are shared between consecutive
+    snapshots, which makes diff() and keeping a history cheap.
+    """
+
+    __slots__ = ('timestamp', 'layout', 'state', 'di', 'di_len', 'do',
+                 'do_len', 'position', 'message', 'config')
+
+    def __init__(self, timestamp, layout, state, di, di_len, do, do_len,
+                 position, message, config=None):
+        set_field = object.__setattr__
+        set_field(self, 'timestamp', timestamp)
+        set_field(self, 'layout', layout)
+        set_field(self, 'state', state)
+        set_field(self, 'di', di)
+        set_field(self, 'di_len', di_len)
+        set_field(self, 'do', do)
+        set_field(self, 'do_len', do_len)
+        set_field(self, 'position', position)
+        set_field(self, 'message', message)
+        set_field(self, 'config', config)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("StatusSnapshot is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("StatusSnapshot is read-only")
+
+    def __repr__(self):
+        return 'StatusSnapshot(timestamp=%r, %r)' % (self.timestamp,
+                                                     dict(self))
+
+    def __reduce__(self):
+        return (StatusSnapshot, (self.timestamp, self.layout, self.state,
+                                 self.di, self.di_len, self.do, self.do_len,
+                                 self.position, self.message, self.config))
+
+    # immutable: a copy can be the snapshot itself, sharing its layout
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __getitem__(self, key):
+        field, i = self.layout.index[key]
+        if field == FIELD_STATE:
+            if i < len(self.state):
+                return self.state[i]
+        elif field == FIELD_DI:
+            if i < self.di_len:
+                return bool(self.di >> i & 1)
+        elif field == FIELD_DO:
+            if i < self.do_len:
+                return bool(self.do >> i & 1)
+        elif field == FIELD_POSITION:
+            if i < len(self.position):
+                return self.position[i]
+        elif field == FIELD_MESSAGE:
+            if self.message is not None:
+                return self.message
+        elif self.config is not None:
+            return self.config
+        raise KeyError(key)
+
+    def __iter__(self):
+        layout = self.layout
+        for i in range(min(len(self.state), len(layout.state_keys))):
+            for key in layout.state_keys[i]:
+                yield key
+        for i, key in sorted(layout.di_bits.items()):
+            if i < self.di_len:
+                yield key
+        for i, key in sorted(layout.do_bits.items()):
+            if i < self.do_len:
+                yield key
+        for i in range(min(len(self.position), len(layout.position_keys))):
+            yield layout.position_keys[i]
+        if self.message is not None:
+            yield layout.message_key
+        if self.config is not None:
+            yield layout.config_key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def diff(self, previous):
+        """
+        Compare with an older snapshot. Fields shared with it are skipped
+        and the di/do registers are compared by XOR of their bitmasks.
+
+        :param previous: Older StatusSnapshot, or None.
+        :return: Dict key -> (old_value, new_value) of the changed values.
+        """
+        changes = {}
+        layout = self.layout
+        if previous is None or previous.layout is not layout:
+            for key, value in self.items():
+                changes[key] = (None, value)
+            return changes
+
+        if self.state is not previous.state:
+            self._diff_columns(previous.state, self.state, layout.state_keys,
+                               changes)
+        if self.di is not previous.di or self.di_len != previous.di_len:
+            self._diff_bits(previous.di, previous.di_len, self.di,
+                            self.di_len, layout.di_bits, changes)
+        if self.do is not previous.do or self.do_len != previous.do_len:
+            self._diff_bits(previous.do, previous.do_len, self.do,
+                            self.do_len, layout.do_bits, changes)
+        if self.position is not previous.position:
+            self._diff_columns(previous.position, self.position,
+                               [(key,) for key in layout.position_keys],
+                               changes)
+        if self.message != previous.message:
+            changes[layout.message_key] = (previous.message, self.message)
+        if self.config is not None and self.config != previous.config:
+            changes[layout.config_key] = (previous.config, self.config)
+        return changes
+
+    @staticmethod
+    def _diff_columns(old, new, keys, changes):
+        for i in range(min(len(new), len(keys))):
+            value = new[i]
+            if i >= len(old):
+                old_value = None
+            elif old[i] == value:
+                continue
+            else:
+                old_value = old[i]
+            for key in keys[i]:
+                changes[key] = (old_value, value)
+
+    @staticmethod
+    def _diff_bits(old, old_len, new, new_len, bits, changes):
+        if old_len == new_len:
+            for i in _iter_bits(old ^ new):
+                key = bits.get(i)
+                if key is not None:
+                    value = bool(new >> i & 1)
+                    changes[key] = (not value, value)
+        else:
+            for i, key in bits.items():
+                if i >= new_len:
+                    continue
+                value = bool(new >> i & 1)
+                if i >= old_len:
+                    changes[key] = (None, value)
+                elif bool(old >> i & 1) != value:
+                    changes[key] = (not value, value)
@@ -1,37 +1,33 @@
 import time
+import json
 import logging
 from tango import (Device_4Impl, DeviceClass, DevState, DevVoid,
                    DevUShort, DevFloat, DevBoolean, DevString, DevShort,
-                   DevVarStringArray, ArgType, READ, SCALAR, SPECTRUM)
+                   DevLong,
+                   DevVarStringArray, ArgType, AttrQuality, READ, SCALAR,
+                   SPECTRUM)
 from .utils import CATS2TANGO, TANGO2CATS
 from ..messages import di_help, do_help, message_help
-from ..core import CS8Connection
+from ..core import CS8Connection, STATUS_REGISTERS
+from ..acquisition import AcquisitionScheduler
+from ..reconnection import Reconnection
+from ..replay import Replay
 from ..logger import get_logger
 from .. import __version__
 
 
-# class StatusUpdateThread(threading.Thread):
-#     def __init__(self, ds):
-#         threading.Thread.__init__(self)
-#         self.ds = ds
-#         self.should_run = False
-#
-#     def stopRunning(self):
-#         self.should_run = False
-#
-#     def run(self):
-#         while self.should_run:
-#             try:
-#                 new_status_dict = self.ds.cs8connection.getStatusDict()
-#                 self.ds.processStatusDict(new_status_dict)
-#             except Exception as e:
-#                 import traceback
-#                 print("error reading status", traceback.format_exc())
-#                 self.ds.notifyNewState(
-#                     DevState.ALARM,
-#                     'Exception getting status from the CATS system:\n%s' %
-#                     str(e))
-#             time.sleep(self.ds.update_freq_ms / 1000.)
+_SCHEDULER = None
+
+
+def get_acquisition_scheduler():
+    """
+    :return: The AcquisitionScheduler shared by all the CATS devices of the
+      server process.
+    """
+    global _SCHEDULER
+    if _SCHEDULER is None:
+        _SCHEDULER = AcquisitionScheduler()
+    return _SCHEDULER
 
 
 class CATS(Device_4Impl):
@@ -42,7 +38,14 @@ class CATS(Device_4Impl):
         Device_4Impl.__init__(self, klass, name)
         self.cs8connection = CS8Connection()
         self.logger = get_logger(__name__)
-        # self.status_update_thread = None
+        self.status_acquisition = None
+        self.reconnection = None
+        self.replay = None
+        self.connection_info = None
+        self.plc_stale = False
+        self.invalid_keys = frozenset()
+        self.condition_waiter = None
+        self.condition_met = False
         self.status_dict = {}
         self.init_device()
 
@@ -56,51 +59,231 @@ class CATS(Device_4Impl):
                          self.update_freq_ms)
         self.logger.info('Ready to accept requests.')
 
-    def update_status(self):
-        if self.cs8connection.connected:
-            # self.logger.debug("getting status dict...")
+    def update_status(self, timeout=None):
+        """
+        Consume the status published by the acquisition. Waits for a new
+        status at most timeout seconds (default one update period), so the
+        event loop keeps running while the CATS is disconnected.
+        """
+        if timeout is None:
+            timeout = self.update_freq_ms / 1000.
+        if self.status_acquisition is None:
+            time.sleep(timeout)
+            return
+
+        published = self.status_acquisition.consume(timeout=timeout)
+        if published is None or self.get_state() == DevState.FAULT:
+            return
+
+        snapshot, changes, error = published
+        # the changes published before a failed poll are not published
+        # again, so they are applied before reporting the error
+        if error is None or changes:
             try:
-                new_status_dict = self.cs8connection.get_status_dict()
-                self.process_status_dict(new_status_dict)
+                self.check_plc_watchdog(snapshot.timestamp)
+                self.check_condition()
+                self.process_status_delta(snapshot.timestamp, changes)
             except Exception as e:
                 import traceback
-                self.logger.error("Error reading status: %s" % traceback.format_exc())
+                self.logger.error("Error processing status: %s" % traceback.format_exc())
                 self.notify_new_state(
                     DevState.ALARM,
-                    'Exception when getting status from CATS server:\n%s' %
+                    'Exception when processing status from CATS server:\n%s' %
                     str(e))
-            time.sleep(self.update_freq_ms / 1000.)
+
+        if error is not None:
+            self.logger.error("Error reading status: %s" % error)
+            self.notify_new_state(
+                DevState.ALARM,
+                'Exception when getting status from CATS server:\n%s' %
+                str(error))
+
+    def check_plc_watchdog(self, timestamp):
+        """
+        Follow the PLC life bit watchdog. While the PLC is stale the di
+        attributes are pushed with ATTR_INVALID quality and the device is
+        in ALARM state (see process_status_delta).
+        """
+        stale = self.cs8connection.is_plc_stale()
+        if stale == self.plc_stale:
+            return
+        self.plc_stale = stale
+        self.push_change_event('PLCLifeBitStale', stale)
+        di_keys = self.cs8connection.get_status_layout().di_bits.values()
+        if stale:
+            self.invalid_keys = frozenset(di_keys)
+            quality = AttrQuality.ATTR_INVALID
         else:
-            # self.logger.debug("Requesting reconnection...")
-            time.sleep(self.update_freq_ms / 1000.)
+            self.invalid_keys = frozenset()
+            quality = AttrQuality.ATTR_VALID
+        for catsk in di_keys:
+            if catsk in self.status_dict:
+                self.push_change_event(CATS2TANGO[catsk],
+                                       self.status_dict[catsk], timestamp,
+                                       quality)
+
+    def check_condition(self):
+        """
+        Push ConditionMet when the condition of wait_until is satisfied.
+        """
+        waiter = self.condition_waiter
+        met = waiter is not None and waiter.is_set()
+        if met != self.condition_met:
+            self.condition_met = met
+            self.push_change_event('ConditionMet', met)
 
     def check_reconnection(self):
-        if not self.cs8connection.connected:
-            self.cs8connection.reconnect(every=self.reconnection_interval,
-                                         timeout=self.reconnection_timeout)
+        """
+        Start the background reconnection when the connection is lost and
+        push the connection state. Never blocks. When the reconnection
+        timeout is reached the device goes to FAULT until it is initialized
+        again, the other devices of the server keep running.
+        """
+        if self.reconnection is None:
+            return
+        try:
+            self.reconnection.check()
+        except RuntimeError as e:
+            if self.get_state() != DevState.FAULT:
+                self.logger.error("Reconnection to the CATS system failed: %s"
+                                  % str(e))
+                self.notify_new_state(
+                    DevState.FAULT,
+                    'Reconnection to the CATS system failed:\n%s\n'
+                    'Run Init to try again.' % str(e))
+        finally:
+            self.push_connection_info()
+
+    def push_connection_info(self):
+        reconnection = self.reconnection
+        info = (reconnection.state, reconnection.attempts,
+                reconnection.failures)
+        if info == self.connection_info:
+            return
+        self.connection_info = info
+        self.push_change_event('ConnectionState', info[0])
+        self.push_change_event('ReconnectionAttempts', info[1])
+        self.push_change_event('ReconnectionFailures', info[2])
 
     def init_device(self):
         self.get_device_properties(self.get_device_class())
         try:
             self.cs8connection.set_model(self.model)
             self.cs8connection.set_puck_types(self.puck_types)
-            self.cs8connection.connect(
-                self.host, self.port_operate, self.port_monitor)
-            # self.status_update_thread = StatusUpdateThread(self)
-            # self.status_update_thread.start()
-            self.notify_new_state(
-                DevState.ON,
-                'Connected to the CATS system.')
+            self.cs8connection.set_pipelined(self.pipelined_monitor)
+            self.cs8connection.set_register_periods(
+                self.get_register_periods())
+            self.cs8connection.set_command_deadlines(
+                self.get_command_deadlines())
+            self.cs8connection.set_standby_monitor(
+                self.standby_check_ms / 1000.)
+            self.cs8connection.set_keepalive(self.keepalive_idle_s)
+            self.cs8connection.set_life_bit_watchdog(
+                self.life_bit_max_cycles)
+            self.cs8connection.set_history(self.history_capacity)
+            self.cs8connection.set_recorder(
+                self.recorder_directory,
+                max_bytes=self.recorder_max_mb << 20,
+                max_age=self.recorder_max_age_s)
+            if self.replay_path:
+                replay = Replay(self.cs8connection, self.replay_path,
+                                self.replay_speed)
+                replay.attach()
+                self.replay = replay
+                self.notify_new_state(
+                    DevState.ON,
+                    'Replaying the recording %s.' % self.replay_path)
+            else:
+                self.cs8connection.connect(
+                    self.host, self.port_operate, self.port_monitor)
+                self.notify_new_state(
+                    DevState.ON,
+                    'Connected to the CATS system.')
         except Exception as e:
             self.notify_new_state(
                 DevState.ALARM,
                 'Exception connecting to the CATS system:\n' + str(e))
 
+        self.reconnection = Reconnection(
+            self.cs8connection, self.reconnection_interval,
+            self.reconnection_timeout, self.reconnection_max_interval)
+
+        # The acquisition keeps being scheduled while disconnected and
+        # resumes polling once the connection is back
+        min_period = (self.update_min_ms or self.update_freq_ms) / 1000.
+        max_period = (self.update_max_ms or self.update_freq_ms) / 1000.
+        shortest = self.cs8connection.get_shortest_register_period()
+        if shortest is not None and shortest < max_period:
+            self.logger.info("Status read at least every %s ms for the "
+                             "register periods" % (1000 * shortest))
+            max_period = shortest
+            min_period = min(min_period, shortest)
+        self.status_acquisition = get_acquisition_scheduler().add(
+            self.cs8connection, min_period, max_period)
+
+    def get_register_periods(self):
+        """
+        Parse the register_periods_ms property ("register=period_ms").
+
+        :return: Dict register -> period in seconds.
+        """
+        periods = self.parse_times_ms(self.register_periods_ms,
+                                      'register_periods_ms')
+        for register in sorted(set(periods).difference(STATUS_REGISTERS)):
+            self.logger.warning("Ignoring the period of the unknown status "
+                                "register %s" % register)
+            del periods[register]
+        return periods
+
+    def get_command_deadlines(self):
+        """
+        Parse the command_deadlines_ms property ("command=deadline_ms").
+
+        :return: Dict command -> deadline in seconds.
+        """
+        return self.parse_times_ms(self.command_deadlines_ms,
+                                   'command_deadlines_ms')
+
+    def parse_times_ms(self, items, prop):
+        """
+        Parse "name=time_ms" entries. Malformed entries are logged and
+        ignored, so a typo in a property does not prevent the connection.
+
+        :param items: List of entries.
+        :param prop: Name of the property, for the log.
+        :return: Dict name -> time in seconds.
+        """
+        times = {}
+        for item in items:
+            try:
+                name, time_ms = item.split('=')
+                time_ms = int(time_ms)
+                if time_ms < 0:
+                    raise ValueError()
+            except ValueError:
+                self.logger.warning("Ignoring the malformed entry %r of %s" %
+                                    (item, prop))
+                continue
+            times[name.strip()] = time_ms / 1000.
+        return times
+
     def delete_device(self):
-        # if self.status_update_thread is not None:
-        #     self.status_update_thread.stopRunning()
+        if self.reconnection is not None:
+            self.reconnection.stop()
+        self.reconnection = None
+        self.connection_info = None
+        if self.status_acquisition is not None:
+            get_acquisition_scheduler().remove(self.status_acquisition)
+        self.status_acquisition = None
         self.status_dict = {}
-        self.cs8connection.disconnect()
+        if self.condition_waiter is not None:
+            self.cs8connection.remove_waiter(self.condition_waiter)
+        self.condition_waiter = None
+        self.condition_met = False
+        if self.replay is not None:
+            self.replay.detach()
+        self.replay = None
+        self.cs8connection.close()
 
     def notify_new_state(self, state, status=None):
         self.set_state(state)
@@ -110,14 +293,17 @@ class CATS(Device_4Impl):
         self.push_change_event('State', state)
         self.push_change_event('Status', status)
 
-    def process_status_dict(self, new_status_dict):
+    def process_status_delta(self, timestamp, changes):
 
-        for catsk, new_value in new_status_dict.items():
-            if new_status_dict[catsk] != self.status_dict.get(catsk, None):
-                self.status_dict[catsk] = new_value
-                # Notify any tango client that the value has changed
-                attr_name = CATS2TANGO[catsk]
-                self.push_change_event(attr_name, new_value)
+        for catsk, (_, new_value) in changes.items():
+            self.status_dict[catsk] = new_value
+            # Notify any tango client that the value has changed
+            attr_name = CATS2TANGO[catsk]
+            if catsk in self.invalid_keys:
+                quality = AttrQuality.ATTR_INVALID
+            else:
+                quality = AttrQuality.ATTR_VALID
+            self.push_change_event(attr_name, new_value, timestamp, quality)
 
         new_status = 'Powered = %s\n' % \
                      self.status_dict[TANGO2CATS['Powered']]
@@ -190,7 +376,12 @@ class CATS(Device_4Impl):
             new_status += 'CurrentNumberOfSoaking = %s\n' % \
                           self.status_dict[TANGO2CATS['CurrentNumberOfSoaking']]
 
-        if new_status_dict[TANGO2CATS['Path']] != '':
+        if self.plc_stale:
+            self.notify_new_state(
+                DevState.ALARM,
+                'PLC life bits not toggling, the PLC signals are stale.\n' +
+                new_status)
+        elif self.status_dict[TANGO2CATS['Path']] != '':
             self.notify_new_state(DevState.RUNNING, new_status)
         else:
             self.notify_new_state(DevState.ON, new_status)
@@ -689,12 +880,40 @@ class CATS(Device_4Impl):
     def read_Message(self, attr): attr.set_value(
         self.status_dict[TANGO2CATS['Message']])
 
+    # CONFIG
+    def read_Config(self, attr): attr.set_value(
+        self.status_dict.get(TANGO2CATS['Config'], ''))
+
     # Convenience values
     def read_SampleOnDiff(self, attr): attr.set_value(self.is_sample_on_diff())
 
     # Version
     def read_Version(self, attr): attr.set_value(__version__)
 
+    # Connection
+    def read_PLCLifeBitStale(self, attr): attr.set_value(self.plc_stale)
+
+    def read_ConditionMet(self, attr): attr.set_value(self.condition_met)
+
+    def read_WaitCondition(self, attr): attr.set_value(
+        self.condition_waiter.condition.text
+        if self.condition_waiter is not None else '')
+
+    def read_StopLatency(self, attr): attr.set_value(
+        1000. * self.cs8connection.priority_stats.last)
+
+    def read_StopLatencyMax(self, attr): attr.set_value(
+        1000. * self.cs8connection.priority_stats.max)
+
+    def read_ConnectionState(self, attr): attr.set_value(
+        self.reconnection.state)
+
+    def read_ReconnectionAttempts(self, attr): attr.set_value(
+        self.reconnection.attempts)
+
+    def read_ReconnectionFailures(self, attr): attr.set_value(
+        self.reconnection.failures)
+
     #################################################################
     ######################## EXECUTE COMMANDS #######################
     #################################################################
@@ -704,11 +923,21 @@ class CATS(Device_4Impl):
 
     def powerOff(self): return self.cs8connection.powerOff()
 
-    def panic(self): return self.cs8connection.panic()
+    # abort, panic and pause go through the priority lane of the
+    # CS8Connection
+    def panic(self): return self.stop_command(self.cs8connection.panic)
 
-    def abort(self): return self.cs8connection.abort()
+    def abort(self): return self.stop_command(self.cs8connection.abort)
 
-    def pause(self): return self.cs8connection.pause()
+    def pause(self): return self.stop_command(self.cs8connection.pause)
+
+    def stop_command(self, command):
+        try:
+            return command()
+        finally:
+            stats = self.cs8connection.priority_stats
+            self.push_change_event('StopLatency', 1000. * stats.last)
+            self.push_change_event('StopLatencyMax', 1000. * stats.max)
 
     def reset(self): return self.cs8connection.reset()
 
@@ -1033,6 +1262,37 @@ class CATS(Device_4Impl):
 
     def mon_config(self): return self.cs8connection.config()
 
+    def wait_until(self, condition):
+        """
+        Watch a condition on the status keys without blocking. ConditionMet
+        becomes True (with a change event) once the condition is satisfied,
+        and stays so until the next call.
+
+        :return: True if the condition is already satisfied.
+        """
+        if self.condition_waiter is not None:
+            self.cs8connection.remove_waiter(self.condition_waiter)
+            self.condition_waiter = None
+        self.check_condition()
+        self.condition_waiter = self.cs8connection.add_waiter(condition)
+        self.check_condition()
+        return self.condition_met
+
+    def dump_history(self, seconds):
+        """
+        :param seconds: Length of the dump before the current time.
+        :return: JSON list of [timestamp, {key: value}], the first entry with
+          the whole status in effect at the beginning of the dump (with the
+          time it was read) and the next ones with the keys that changed.
+        """
+        history = self.cs8connection.history
+        if history is None:
+            raise Exception("The status history is disabled")
+        deltas = history.deltas(self.cs8connection.clock() - seconds)
+        return json.dumps([
+            [timestamp, dict((key, new) for key, (_, new) in changes.items())]
+            for timestamp, changes in deltas])
+
     # BACKDOOR FOR SOFTWARE UPGRADES OR ANYTHING NEEDED... ;-D
     def send_op_cmd(self, cmd): return self.cs8connection.operate(cmd)
 
@@ -1070,7 +1330,73 @@ class CATSClass(DeviceClass):
                                  [30]],
         'reconnection_interval': [DevUShort,
                                   "Wait time in seconds between reconnection attempts",
-                                  [5]]
+                                  [5]],
+        'reconnection_max_interval': [DevUShort,
+                                      "Longest wait time in seconds between "
+                                      "reconnection attempts "
+                                      "(0 = 8 x reconnection_interval).",
+                                      [0]],
+        'pipelined_monitor': [DevBoolean,
+                              "Send all the status requests in one burst.",
+                              [True]],
+        'update_min_ms': [DevUShort,
+                          "Update time in ms while a path is running "
+                          "(0 = update_freq_ms).",
+                          [0]],
+        'update_max_ms': [DevUShort,
+                          "Longest update time in ms while the robot is idle "
+                          "(0 = update_freq_ms).",
+                          [0]],
+        'standby_check_ms': [DevUShort,
+                             "Health check period in ms of a spare monitor "
+                             "socket used when the monitor socket fails "
+                             "(0 = no spare socket).",
+                             [0]],
+        'keepalive_idle_s': [DevUShort,
+                             "TCP keepalive on the sockets: idle time in "
+                             "seconds before probing the link every second "
+                             "(0 = no keepalive).",
+                             [0]],
+        'life_bit_max_cycles': [DevUShort,
+                                "Status reads without toggle of the PLC "
+                                "life bits before the PLC is stale "
+                                "(0 = no watchdog).",
+                                [0]],
+        'history_capacity': [DevLong,
+                             "Number of status snapshots kept in memory for "
+                             "the dump_history command (0 = no history).",
+                             [36000]],
+        'recorder_directory': [DevString,
+                               "Directory where the raw replies of the "
+                               "monitor socket are recorded (empty = no "
+                               "recording).",
+                               ['']],
+        'recorder_max_mb': [DevUShort,
+                            "Size in MB of a recording file before a new "
+                            "one is started.",
+                            [64]],
+        'recorder_max_age_s': [DevLong,
+                               "Age in seconds of a recording file before a "
+                               "new one is started.",
+                               [3600]],
+        'replay_path': [DevString,
+                        "Recording file or directory replayed instead of "
+                        "connecting to the CATS system (empty = no replay).",
+                        ['']],
+        'replay_speed': [DevFloat,
+                         "Speed of the replay, 1 for real time "
+                         "(0 = as fast as possible).",
+                         [1.]],
+        'command_deadlines_ms': [DevVarStringArray,
+                                 "Time allowed for the answer of some "
+                                 "commands, as command=deadline_ms (e.g. "
+                                 "backup=60000, state=500).",
+                                 []],
+        'register_periods_ms': [DevVarStringArray,
+                                "Polling period of some status registers, as "
+                                "register=period_ms (e.g. position=50, "
+                                "message=1000, config=10000).",
+                                []]
     }
 
     attr_list = {
@@ -1360,10 +1686,29 @@ class CATSClass(DeviceClass):
 
         # MESSAGE
         'Message': [[DevString, SCALAR, READ]],
+        'Config': [[DevString, SCALAR, READ]],
 
         # Convenience values
         'SampleOnDiff': [[DevBoolean, SCALAR, READ]],
-        'Version': [[DevString, SCALAR, READ]]
+        'Version': [[DevString, SCALAR, READ]],
+
+        # Connection
+        'PLCLifeBitStale': [[DevBoolean, SCALAR, READ]],
+        'ConditionMet': [[DevBoolean, SCALAR, READ],
+                         {'description': 'The condition of the last '
+                                         'wait_until command is satisfied'}],
+        'WaitCondition': [[DevString, SCALAR, READ],
+                          {'description': 'Condition of the last '
+                                          'wait_until command'}],
+        'StopLatency': [[DevFloat, SCALAR, READ],
+                        {'unit': 'ms',
+                         'description': 'Latency of the last abort, panic '
+                                        'or pause command.'}],
+        'StopLatencyMax': [[DevFloat, SCALAR, READ],
+                           {'unit': 'ms'}],
+        'ConnectionState': [[DevString, SCALAR, READ]],
+        'ReconnectionAttempts': [[DevLong, SCALAR, READ]],
+        'ReconnectionFailures': [[DevLong, SCALAR, READ]]
     }
 
     cmd_list = {
@@ -1474,6 +1819,8 @@ class CATSClass(DeviceClass):
         'mon_position': [[DevVoid], [DevString], ],
         'mon_message': [[DevVoid], [DevString], ],
         'mon_config': [[DevVoid], [DevString], ],
+        'dump_history': [[DevFloat, 'seconds before the current time'], [DevString], ],
+        'wait_until': [[DevString, 'condition on the status keys, e.g. PATH_RUNNING_1_0 false and PRO5_IDL true'], [DevBoolean], ],
 
         # BACKDOOR FOR SOFTWARE UPGRADES OR ANYTHING NEEDED... ;-D
         'send_op_cmd': [[DevString], [DevString], ],
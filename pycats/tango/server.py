@@ -1,25 +1,36 @@
 import sys
+import time
 
 from tango import DevFailed, Util
-from .device import CATS, CATSClass
+from .device import CATS, CATSClass, get_acquisition_scheduler
 
 SERVER_NAME = 'PyCATS'
-_DEVICE_REF = None
 _UTIL = None
 
+# wait when the server has no CATS device
+_IDLE_WAIT = 0.1
+
+
+def get_cats_devices():
+    return [dev for dev in _UTIL.get_device_list("*")
+            if isinstance(dev, CATS)]
+
 
 def core_loop():
-    global _DEVICE_REF
-
-    if _DEVICE_REF is not None:
-        CATS.check_reconnection(_DEVICE_REF)
-        CATS.update_status(_DEVICE_REF)
-    else:
-        dev_list = _UTIL.get_device_list("*")
-        for dev in dev_list:
-            if isinstance(dev, CATS):
-                _DEVICE_REF = dev
-                break
+    devices = get_cats_devices()
+    if not devices:
+        time.sleep(_IDLE_WAIT)
+        return
+
+    for dev in devices:
+        CATS.check_reconnection(dev)
+
+    # every device has its own acquisition schedule: wake up as soon as any
+    # of them publishes a new status
+    timeout = min(dev.update_freq_ms for dev in devices) / 1000.
+    get_acquisition_scheduler().wait(timeout)
+    for dev in devices:
+        CATS.update_status(dev, timeout=0)
 
 
 def run(args=None):
@@ -158,7 +158,10 @@ CATS2TANGO = {
     'RZ_POSITION_IN_MM': 'RZpos',
 
     # MESSAGE
-    'MESSAGE': 'Message'
+    'MESSAGE': 'Message',
+
+    # CONFIG (only when polled, see register_periods_ms)
+    'CONFIG': 'Config'
 }
 
 TANGO2CATS = {}
@@ -0,0 +1,90 @@
+import socket
+
+
+__all__ = ['LifeBitWatchdog', 'LIFE_BITS', 'enable_keepalive']
+
+
+# di signals toggled periodically by the PLC while it runs
+LIFE_BITS = ('LIFE_BIT_COMING_FROM_PLC', 'MODBUS_PLC_LIFE_BIT')
+
+
+def enable_keepalive(sock, idle=1, interval=1, count=3):
+    """
+    Enable TCP keepalive on a socket, so that a dead link is detected after
+    about idle + interval * count seconds even while the socket is idle.
+    Where supported, TCP_USER_TIMEOUT bounds by the same time how long
+    sent data may stay unacknowledged.
+
+    :param sock: Connected socket.
+    :param idle: Idle time in seconds before the first probe.
+    :param interval: Time in seconds between probes.
+    :param count: Number of unanswered probes before the link is dead.
+    :return: None
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+    elif hasattr(socket, 'TCP_KEEPALIVE'):  # macOS
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle)
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval)
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, count)
+    if hasattr(socket, 'TCP_USER_TIMEOUT'):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_USER_TIMEOUT,
+                        1000 * (idle + interval * count))
+
+
+class LifeBitWatchdog:
+    """
+    Detect a frozen PLC from its life bits, which toggle while it runs.
+
+    A life bit is stale when it keeps the same value during max_cycles
+    consecutive reads of the di register. max_cycles must be larger than
+    the number of status reads between two toggles of the life bits.
+
+    :param max_cycles: Number of reads without toggle before a life bit is
+      stale.
+    :param keys: Status keys of the life bits.
+    """
+
+    def __init__(self, max_cycles, keys=LIFE_BITS):
+        self.max_cycles = max_cycles
+        self.keys = tuple(keys)
+        self.stale = False
+        self.cycles = dict.fromkeys(self.keys, 0)
+        self._values = {}
+
+    def reset(self):
+        self.stale = False
+        self.cycles = dict.fromkeys(self.keys, 0)
+        self._values = {}
+
+    def update(self, snapshot):
+        """
+        Account for a new read of the di register.
+
+        :param snapshot: StatusSnapshot of the read.
+        :return: True if the staleness changed with this read.
+        """
+        for key in self.keys:
+            value = snapshot.get(key)
+            if value is None:
+                continue
+            if self._values.get(key) == value:
+                self.cycles[key] += 1
+            else:
+                self.cycles[key] = 0
+            self._values[key] = value
+
+        stale = bool(self.stale_keys())
+        changed = stale != self.stale
+        self.stale = stale
+        return changed
+
+    def stale_keys(self):
+        """
+        :return: List of the life bits that stopped toggling.
+        """
+        return [key for key in self.keys
+                if self.cycles[key] >= self.max_cycles]